@@ -0,0 +1,8 @@
+import logging
+
+from app import app
+from src.services.analytics_queue import analytics_queue
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    analytics_queue.run_worker(app)
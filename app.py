@@ -7,6 +7,7 @@ from flask import Flask, send_from_directory, jsonify
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from src.config import config
+from src.json_provider import OrjsonProvider
 from src.models import db
 
 def create_app(config_name=None):
@@ -19,6 +20,9 @@ def create_app(config_name=None):
     # Load configuration
     app.config.from_object(config[config_name])
     
+    # Serialize all jsonify() responses with orjson
+    app.json = OrjsonProvider(app)
+    
     # Initialize extensions
     db.init_app(app)
     
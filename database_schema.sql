@@ -65,7 +65,7 @@ CREATE TABLE company_users (
     role VARCHAR(50) NOT NULL DEFAULT 'member',
     permissions JSONB DEFAULT '{}',
     invited_by UUID REFERENCES users(id),
-    invited_at TIMESTAMP WITH TIME ZONE,
+    invited_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     joined_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
     UNIQUE(company_id, user_id)
@@ -129,6 +129,9 @@ CREATE TABLE chatbots (
     webhook_url VARCHAR(500),
     webhook_secret VARCHAR(255),
     last_deployed_at TIMESTAMP WITH TIME ZONE,
+    total_conversations INTEGER NOT NULL DEFAULT 0,
+    total_messages INTEGER NOT NULL DEFAULT 0,
+    last_message_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
     deleted_at TIMESTAMP WITH TIME ZONE
@@ -277,6 +280,7 @@ CREATE TABLE usage_tracking (
 
 -- Users table indexes
 CREATE INDEX idx_users_email ON users(email);
+CREATE UNIQUE INDEX idx_users_email_lower ON users(LOWER(email));
 CREATE INDEX idx_users_role ON users(role);
 CREATE INDEX idx_users_active ON users(is_active) WHERE is_active = true;
 CREATE INDEX idx_users_created_at ON users(created_at);
@@ -290,18 +294,23 @@ CREATE INDEX idx_companies_created_at ON companies(created_at);
 -- Company users indexes
 CREATE INDEX idx_company_users_company_id ON company_users(company_id);
 CREATE INDEX idx_company_users_user_id ON company_users(user_id);
+CREATE UNIQUE INDEX idx_company_users_user_id_company_id ON company_users(user_id, company_id);
 
 -- Subscriptions indexes
 CREATE INDEX idx_subscriptions_company_id ON subscriptions(company_id);
 CREATE INDEX idx_subscriptions_status ON subscriptions(status);
 CREATE INDEX idx_subscriptions_current_period_end ON subscriptions(current_period_end);
 CREATE INDEX idx_subscriptions_stripe_customer_id ON subscriptions(stripe_customer_id);
+CREATE UNIQUE INDEX idx_subscriptions_stripe_subscription_id ON subscriptions(stripe_subscription_id);
+CREATE INDEX idx_subscriptions_company_id_status ON subscriptions(company_id, status);
+CREATE INDEX idx_subscriptions_company_id_current ON subscriptions(company_id) WHERE status IN ('active', 'trialing', 'past_due');
 
 -- Chatbots indexes
 CREATE INDEX idx_chatbots_company_id ON chatbots(company_id);
 CREATE INDEX idx_chatbots_status ON chatbots(status);
 CREATE INDEX idx_chatbots_botpress_bot_id ON chatbots(botpress_bot_id);
 CREATE INDEX idx_chatbots_whatsapp_phone ON chatbots(whatsapp_phone_number);
+CREATE INDEX idx_chatbots_whatsapp_phone_number_id ON chatbots(whatsapp_phone_number_id);
 
 -- Conversations indexes
 CREATE INDEX idx_conversations_chatbot_id ON conversations(chatbot_id);
@@ -309,9 +318,11 @@ CREATE INDEX idx_conversations_customer_phone ON conversations(customer_phone);
 CREATE INDEX idx_conversations_status ON conversations(status);
 CREATE INDEX idx_conversations_started_at ON conversations(started_at);
 CREATE INDEX idx_conversations_last_message_at ON conversations(last_message_at);
+CREATE INDEX idx_conversations_chatbot_id_status_last_message_at ON conversations(chatbot_id, status, last_message_at DESC NULLS LAST, id DESC);
 
 -- Messages indexes (applied to all partitions)
-CREATE INDEX idx_messages_conversation_id ON messages(conversation_id);
+-- Serves per-conversation message pages (newest first, keyset on timestamp + id); also covers conversation_id lookups
+CREATE INDEX idx_messages_conversation_id_timestamp ON messages(conversation_id, timestamp DESC, id DESC);
 CREATE INDEX idx_messages_direction ON messages(direction);
 CREATE INDEX idx_messages_timestamp ON messages(timestamp);
 CREATE INDEX idx_messages_whatsapp_message_id ON messages(whatsapp_message_id);
@@ -333,6 +344,10 @@ CREATE INDEX idx_api_keys_company_id ON api_keys(company_id);
 CREATE INDEX idx_api_keys_key_hash ON api_keys(key_hash);
 CREATE INDEX idx_api_keys_active ON api_keys(is_active) WHERE is_active = true;
 
+-- Invoices indexes
+CREATE UNIQUE INDEX idx_invoices_stripe_invoice_id ON invoices(stripe_invoice_id);
+CREATE INDEX idx_invoices_company_id_created_at ON invoices(company_id, created_at);
+
 -- Usage tracking indexes
 CREATE INDEX idx_usage_tracking_company_id ON usage_tracking(company_id);
 CREATE INDEX idx_usage_tracking_period ON usage_tracking(period_start, period_end);
@@ -0,0 +1,29 @@
+-- Upgrades for databases created from an earlier database_schema.sql
+-- Each section is safe to re-run
+
+-- Per-chatbot conversation list index: match the NULLS LAST ordering used by the query
+DROP INDEX IF EXISTS idx_conversations_chatbot_id_status_last_message_at;
+CREATE INDEX idx_conversations_chatbot_id_status_last_message_at ON conversations(chatbot_id, status, last_message_at DESC NULLS LAST, id DESC);
+
+-- Chatbot counters: add the columns and backfill them from existing conversations and messages
+ALTER TABLE chatbots ADD COLUMN IF NOT EXISTS total_conversations INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chatbots ADD COLUMN IF NOT EXISTS total_messages INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chatbots ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP WITH TIME ZONE;
+
+UPDATE chatbots SET
+    total_conversations = COALESCE(conversation_counts.total_conversations, 0),
+    total_messages = COALESCE(message_counts.total_messages, 0),
+    last_message_at = message_counts.last_message_at
+FROM chatbots AS target
+LEFT JOIN (
+    SELECT chatbot_id, COUNT(*) AS total_conversations
+    FROM conversations
+    GROUP BY chatbot_id
+) AS conversation_counts ON conversation_counts.chatbot_id = target.id
+LEFT JOIN (
+    SELECT conversations.chatbot_id, COUNT(*) AS total_messages, MAX(messages.timestamp) AS last_message_at
+    FROM messages
+    JOIN conversations ON conversations.id = messages.conversation_id
+    GROUP BY conversations.chatbot_id
+) AS message_counts ON message_counts.chatbot_id = target.id
+WHERE chatbots.id = target.id;
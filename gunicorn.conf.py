@@ -0,0 +1,6 @@
+# Loaded automatically by gunicorn from the working directory
+
+def post_fork(server, worker):
+    """Make psycopg2 yield to other greenlets while waiting on Postgres"""
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
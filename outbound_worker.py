@@ -0,0 +1,8 @@
+import logging
+
+from app import app
+from src.services.outbound_queue import outbound_queue
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    outbound_queue.run_worker(app)
@@ -36,6 +36,7 @@ class Config:
     # Botpress configuration
     BOTPRESS_API_URL = os.environ.get('BOTPRESS_API_URL', 'https://api.botpress.cloud')
     BOTPRESS_API_TOKEN = os.environ.get('BOTPRESS_API_TOKEN')
+    BOTPRESS_WEBHOOK_SECRET = os.environ.get('BOTPRESS_WEBHOOK_SECRET')
     
     # WhatsApp Business API configuration
     WHATSAPP_API_URL = os.environ.get('WHATSAPP_API_URL', 'https://graph.facebook.com/v18.0')
@@ -56,6 +57,8 @@ class Config:
     # Application URLs
     FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
     BACKEND_URL = os.environ.get('BACKEND_URL', 'http://localhost:5000')
+    # Botpress posts bot events here; built once instead of per request from the Host header
+    BOTPRESS_WEBHOOK_URL = f"{BACKEND_URL.rstrip('/')}/api/webhooks/botpress"
     
     # Redis configuration
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
@@ -74,6 +77,19 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
 
+    # Explicit pool sizing (Postgres). Limits apply per gunicorn worker, so
+    # workers * (pool_size + max_overflow) must stay under max_connections.
+    # Routes release their session before slow external calls, so a modest pool
+    # serves many concurrent greenlets; use NullPool instead if requests ever
+    # hold connections across long external calls.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
+
 class TestingConfig(Config):
     """Testing configuration"""
     DEBUG = True
@@ -0,0 +1,34 @@
+import orjson
+from flask.json.provider import JSONProvider, DefaultJSONProvider
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    # Naive datetimes are stored as UTC throughout the models
+    option = orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+    mimetype = 'application/json'
+
+    def dumps_bytes(self, obj, **kwargs):
+        """Serialize to UTF-8 bytes, honouring the stdlib-style kwargs Flask passes"""
+        option = self.option
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys'):
+            option |= orjson.OPT_SORT_KEYS
+
+        # Fall back to Flask's encoder for types orjson does not handle (Decimal, Markup)
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        """Serialize data as JSON to a string"""
+        return self.dumps_bytes(obj, **kwargs).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """Deserialize data as JSON from a string or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Build a JSON response without the intermediate str round-trip"""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
@@ -134,6 +134,11 @@ class AnalyticsEventTypes:
     CHATBOT_DEPLOYED = 'chatbot_deployed'
     CHATBOT_DEACTIVATED = 'chatbot_deactivated'
     CHATBOT_DELETED = 'chatbot_deleted'
+    BOT_TRAINED = 'bot_trained'
+    
+    # Integration events
+    INTEGRATION_CONNECTED = 'integration_connected'
+    INTEGRATION_UPDATED = 'integration_updated'
     
     # Conversation events
     CONVERSATION_STARTED = 'conversation_started'
@@ -26,8 +26,12 @@ class Chatbot(db.Model):
     webhook_url = db.Column(db.String(500))
     webhook_secret = db.Column(db.String(255))
     last_deployed_at = db.Column(db.DateTime)
+    # Denormalized counters, maintained by Conversation/Message mapper events
+    total_conversations = db.Column(db.Integer, nullable=False, default=0)
+    total_messages = db.Column(db.Integer, nullable=False, default=0)
+    last_message_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
     deleted_at = db.Column(db.DateTime)
     
     # Relationships
@@ -38,6 +42,12 @@ class Chatbot(db.Model):
     analytics_events = db.relationship('AnalyticsEvent', backref='chatbot', lazy=True,
                                       cascade='all, delete-orphan')
     
+    __table_args__ = (
+        # Serves webhook and integration lookups by WhatsApp phone number ID; not unique, since
+        # draft, inactive and deleted chatbots may keep a number that an active one now uses
+        db.Index('idx_chatbots_whatsapp_phone_number_id', 'whatsapp_phone_number_id'),
+    )
+    
     def __init__(self, company_id, name, **kwargs):
         self.company_id = company_id
         self.name = name
@@ -77,8 +87,8 @@ class Chatbot(db.Model):
             if hasattr(self, key):
                 setattr(self, key, value)
     
-    def to_dict(self, include_stats=False):
-        """Convert chatbot to dictionary"""
+    def to_dict(self, include_stats=False, stats=None):
+        """Convert chatbot to dictionary (pass precomputed `stats` to skip the stat queries)"""
         data = {
             'id': self.id,
             'company_id': self.company_id,
@@ -102,9 +112,10 @@ class Chatbot(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
         
-        if include_stats:
-            stats = self.get_stats()
+        if stats is not None:
             data.update(stats)
+        elif include_stats:
+            data.update(self.get_stats())
         
         return data
     
@@ -133,13 +144,84 @@ class Chatbot(db.Model):
             Conversation.status == 'open'
         ).count()
         
+        return Chatbot._build_stats(total_conversations, total_messages, active_conversations, days)
+    
+    def get_detailed_stats(self, days=30):
+        """Get stats plus message-type and daily-conversation breakdowns in one query"""
+        from datetime import timedelta
+        from sqlalchemy import func, literal, cast, null, union_all, String
+        from .conversation import Conversation, Message
+        
+        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        started_date = func.date(Conversation.started_at)
+        
+        # Each branch is tagged with its kind so the rows can be dispatched below
+        message_types = db.select(
+            literal('message_type').label('kind'),
+            cast(Message.type, String).label('key'),
+            func.count(Message.id).label('count')
+        ).join(Conversation, Message.conversation_id == Conversation.id).where(
+            Conversation.chatbot_id == self.id,
+            Message.created_at >= cutoff_date
+        ).group_by(Message.type)
+        
+        daily_conversations = db.select(
+            literal('daily_conversations').label('kind'),
+            cast(started_date, String).label('key'),
+            func.count(Conversation.id).label('count')
+        ).where(
+            Conversation.chatbot_id == self.id,
+            Conversation.started_at >= cutoff_date
+        ).group_by(started_date)
+        
+        active_conversations = db.select(
+            literal('active_conversations').label('kind'),
+            cast(null(), String).label('key'),
+            func.count(Conversation.id).label('count')
+        ).where(
+            Conversation.chatbot_id == self.id,
+            Conversation.status == 'open'
+        )
+        
+        rows = db.session.execute(
+            union_all(message_types, daily_conversations, active_conversations)
+        ).all()
+        
+        message_type_distribution = []
+        daily_conversation_counts = []
+        active_count = 0
+        
+        for kind, key, count in rows:
+            if kind == 'message_type':
+                message_type_distribution.append({'type': key, 'count': count})
+            elif kind == 'daily_conversations':
+                daily_conversation_counts.append({'date': key, 'count': count})
+            else:
+                active_count = count
+        
+        stats = Chatbot._build_stats(
+            sum(row['count'] for row in daily_conversation_counts),
+            sum(row['count'] for row in message_type_distribution),
+            active_count,
+            days
+        )
+        stats.update({
+            'message_type_distribution': message_type_distribution,
+            'daily_conversations': daily_conversation_counts
+        })
+        
+        return stats
+    
+    @staticmethod
+    def _build_stats(total_conversations, total_messages, active_conversations, days):
+        """Shape raw counts into the stats payload returned by the API"""
         # Calculate average response time (placeholder - would need more complex query)
         avg_response_time_minutes = 5  # Placeholder
         
         return {
-            'total_conversations': total_conversations,
-            'total_messages': total_messages,
-            'active_conversations': active_conversations,
+            'total_conversations': total_conversations or 0,
+            'total_messages': total_messages or 0,
+            'active_conversations': active_conversations or 0,
             'avg_response_time_minutes': avg_response_time_minutes,
             'stats_period_days': days
         }
@@ -181,13 +263,8 @@ class Chatbot(db.Model):
     
     def update_configuration(self, new_config):
         """Update chatbot configuration"""
-        if self.configuration:
-            self.configuration.update(new_config)
-        else:
-            self.configuration = new_config
-        
-        # Mark as updated
-        self.updated_at = datetime.utcnow()
+        # Assign a new dict so the change is tracked; updated_at is stamped by the database
+        self.configuration = {**(self.configuration or {}), **(new_config or {})}
     
     def deploy(self):
         """Mark chatbot as deployed"""
@@ -246,16 +323,131 @@ class Chatbot(db.Model):
         
         return errors
     
+    def get_setup_validation(self):
+        """Validate WhatsApp and Botpress setup from the loaded columns (no queries)"""
+        whatsapp_errors = self.validate_whatsapp_setup()
+        botpress_errors = self.validate_botpress_setup()
+        
+        return {
+            'whatsapp_setup_valid': not whatsapp_errors,
+            'whatsapp_errors': whatsapp_errors,
+            'botpress_setup_valid': not botpress_errors,
+            'botpress_errors': botpress_errors
+        }
+    
     @staticmethod
-    def find_by_id(chatbot_id):
-        """Find chatbot by ID (excluding deleted)"""
-        return Chatbot.query.filter_by(id=chatbot_id, deleted_at=None).first()
+    def find_by_id(chatbot_id, with_company=False):
+        """Find chatbot by ID (excluding deleted), checking the session identity map first; `with_company` joins its company on a miss"""
+        from sqlalchemy.orm import joinedload
+        
+        if not chatbot_id:
+            return None
+        options = [joinedload(Chatbot.company)] if with_company else []
+        chatbot = db.session.get(Chatbot, chatbot_id, options=options)
+        return chatbot if chatbot and not chatbot.deleted_at else None
+    
+    @staticmethod
+    def _user_access_filter(user_id):
+        """SQL condition: the chatbot's company is live and the (active) user owns or belongs to it"""
+        from sqlalchemy import or_
+        from .company import Company
+        from .user import User, CompanyUser
+        
+        is_member = db.session.query(CompanyUser.id).filter(
+            CompanyUser.company_id == Company.id,
+            CompanyUser.user_id == user_id
+        ).exists()
+        user_active = db.session.query(User.id).filter(
+            User.id == user_id,
+            User.deleted_at.is_(None)
+        ).exists()
+        
+        return Chatbot.company_id.in_(
+            db.select(Company.id).where(
+                Company.deleted_at.is_(None),
+                or_(Company.owner_id == user_id, is_member),
+                user_active
+            )
+        )
+    
+    @staticmethod
+    def find_by_id_for_user(chatbot_id, user_id):
+        """Find chatbot by ID only if the user owns or belongs to its company, in one query"""
+        return Chatbot.find_for_user(user_id, id=chatbot_id)
+    
+    @staticmethod
+    def find_for_user(user_id, with_company=False, **filters):
+        """Find chatbot by column values (e.g. botpress_bot_id) only if the user has access, in one query"""
+        from sqlalchemy.orm import joinedload
+        
+        query = Chatbot.query.options(joinedload(Chatbot.company)) if with_company else Chatbot.query
+        return query.filter_by(deleted_at=None, **filters).filter(
+            Chatbot._user_access_filter(user_id)
+        ).first()
+    
+    @staticmethod
+    def exists_for_user(user_id, **filters):
+        """Check a chatbot matching the column values exists and the user has access, without loading it"""
+        return db.session.query(
+            Chatbot.query.filter_by(deleted_at=None, **filters).filter(
+                Chatbot._user_access_filter(user_id)
+            ).exists()
+        ).scalar()
+    
+    @staticmethod
+    def soft_delete_for_user(chatbot_id, user_id):
+        """Soft delete a chatbot the user can access with one UPDATE; returns (company_id, name) or None"""
+        return db.session.execute(
+            db.update(Chatbot).where(
+                Chatbot.id == chatbot_id,
+                Chatbot.deleted_at.is_(None),
+                Chatbot._user_access_filter(user_id)
+            ).values(
+                deleted_at=db.func.now(),
+                status='inactive'
+            ).returning(Chatbot.company_id, Chatbot.name),
+            execution_options={'synchronize_session': False}
+        ).first()
     
     @staticmethod
     def find_by_company(company_id):
         """Find all chatbots for a company (excluding deleted)"""
         return Chatbot.query.filter_by(company_id=company_id, deleted_at=None).all()
     
+    @staticmethod
+    def find_by_company_with_stats(company_id):
+        """Find all chatbots for a company with stats from the stored counters plus open conversations"""
+        from sqlalchemy import func
+        from .conversation import Conversation
+        
+        open_counts = db.session.query(
+            Conversation.chatbot_id.label('chatbot_id'),
+            func.count(Conversation.id).label('active_conversations')
+        ).join(
+            Chatbot, Chatbot.id == Conversation.chatbot_id
+        ).filter(
+            Chatbot.company_id == company_id,
+            Conversation.status == 'open'
+        ).group_by(Conversation.chatbot_id).subquery()
+        
+        rows = db.session.query(Chatbot, open_counts.c.active_conversations).outerjoin(
+            open_counts, open_counts.c.chatbot_id == Chatbot.id
+        ).filter(
+            Chatbot.company_id == company_id,
+            Chatbot.deleted_at.is_(None)
+        ).all()
+        
+        results = []
+        for chatbot, active_conversations in rows:
+            # Counters are all-time, so there is no stats period
+            stats = Chatbot._build_stats(
+                chatbot.total_conversations, chatbot.total_messages, active_conversations, None
+            )
+            stats['last_message_at'] = chatbot.last_message_at.isoformat() if chatbot.last_message_at else None
+            results.append((chatbot, stats))
+        
+        return results
+    
     @staticmethod
     def find_by_botpress_id(botpress_bot_id):
         """Find chatbot by Botpress bot ID"""
@@ -20,14 +20,14 @@ class Company(db.Model):
     is_active = db.Column(db.Boolean, nullable=False, default=True)
     owner_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
     deleted_at = db.Column(db.DateTime)
     
-    # Relationships will be defined after all models are loaded
-    # chatbots = db.relationship('Chatbot', backref='company', lazy=True, 
-    #                           cascade='all, delete-orphan')
-    # subscriptions = db.relationship('Subscription', backref='company', lazy=True,
-    #                                cascade='all, delete-orphan')
+    # Relationships
+    chatbots = db.relationship('Chatbot', backref='company', lazy=True, 
+                               cascade='all, delete-orphan')
+    subscriptions = db.relationship('Subscription', backref='company', lazy=True,
+                                    cascade='all, delete-orphan')
     # analytics_events = db.relationship('AnalyticsEvent', backref='company', lazy=True,
     #                                   cascade='all, delete-orphan')
     
@@ -80,11 +80,8 @@ class Company(db.Model):
         return data
     
     def get_current_subscription(self):
-        """Get the current active subscription"""
-        return Subscription.query.filter_by(
-            company_id=self.id,
-            status='active'
-        ).first()
+        """Get the current active subscription (served from `subscriptions` when it is eager-loaded)"""
+        return next((sub for sub in self.subscriptions if sub.status == 'active'), None)
     
     def get_active_chatbots(self):
         """Get all active chatbots for this company"""
@@ -94,10 +91,9 @@ class Company(db.Model):
         """Get all team members including owner"""
         from .user import User, CompanyUser
         
+        # The owner by primary key, then members driven from the company_id index
         members = []
-        
-        # Add owner
-        owner = User.query.get(self.owner_id)
+        owner = db.session.get(User, self.owner_id)
         if owner:
             members.append({
                 'user': owner,
@@ -106,10 +102,16 @@ class Company(db.Model):
                 'joined_at': self.created_at
             })
         
-        # Add other members
-        for membership in self.user_memberships:
+        rows = db.session.query(CompanyUser, User).join(
+            User, User.id == CompanyUser.user_id
+        ).filter(
+            CompanyUser.company_id == self.id,
+            CompanyUser.user_id != self.owner_id
+        ).order_by(CompanyUser.joined_at).all()
+        
+        for membership, user in rows:
             members.append({
-                'user': membership.user,
+                'user': user,
                 'role': membership.role,
                 'permissions': membership.permissions or {},
                 'joined_at': membership.joined_at
@@ -117,6 +119,18 @@ class Company(db.Model):
         
         return members
     
+    def get_team_members_data(self):
+        """Get team members serialized for API responses"""
+        return [
+            {
+                'user': member['user'].to_dict(),
+                'role': member['role'],
+                'permissions': member['permissions'],
+                'joined_at': member['joined_at'].isoformat() if member['joined_at'] else None
+            }
+            for member in self.get_team_members()
+        ]
+    
     def can_create_chatbot(self):
         """Check if company can create more chatbots based on subscription"""
         subscription = self.get_current_subscription()
@@ -130,8 +144,47 @@ class Company(db.Model):
         active_chatbots_count = len(self.get_active_chatbots())
         return active_chatbots_count < plan.max_chatbots
     
+    def get_chatbot_stats_bulk(self, days=30):
+        """Get stats for all of the company's chatbots with grouped queries, keyed by chatbot ID"""
+        from datetime import timedelta
+        from sqlalchemy import func, case
+        from .chatbot import Chatbot
+        from .conversation import Conversation, Message
+        
+        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        
+        conversation_counts = db.session.query(
+            Conversation.chatbot_id,
+            func.count(case((Conversation.started_at >= cutoff_date, 1))),
+            func.count(case((Conversation.status == 'open', 1)))
+        ).join(Chatbot, Chatbot.id == Conversation.chatbot_id).filter(
+            Chatbot.company_id == self.id
+        ).group_by(Conversation.chatbot_id).all()
+        
+        message_counts = dict(db.session.query(
+            Conversation.chatbot_id,
+            func.count(Message.id)
+        ).join(Message, Message.conversation_id == Conversation.id).join(
+            Chatbot, Chatbot.id == Conversation.chatbot_id
+        ).filter(
+            Chatbot.company_id == self.id,
+            Message.created_at >= cutoff_date
+        ).group_by(Conversation.chatbot_id).all())
+        
+        stats = {}
+        for chatbot_id, total_conversations, active_conversations in conversation_counts:
+            stats[chatbot_id] = Chatbot._build_stats(
+                total_conversations,
+                message_counts.get(chatbot_id, 0),
+                active_conversations,
+                days
+            )
+        
+        return stats
+    
     def get_usage_stats(self, period_start=None, period_end=None):
         """Get usage statistics for the company"""
+        from .chatbot import Chatbot
         from .conversation import Conversation, Message
         from .analytics import AnalyticsEvent
         
@@ -186,8 +239,11 @@ class Company(db.Model):
     
     @staticmethod
     def find_by_id(company_id):
-        """Find company by ID (excluding deleted)"""
-        return Company.query.filter_by(id=company_id, deleted_at=None).first()
+        """Find company by ID (excluding deleted), checking the session identity map first"""
+        if not company_id:
+            return None
+        company = db.session.get(Company, company_id)
+        return company if company and not company.deleted_at else None
     
     @staticmethod
     def find_by_owner(owner_id):
@@ -16,7 +16,7 @@ class Conversation(db.Model):
     started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     ended_at = db.Column(db.DateTime)
     last_message_at = db.Column(db.DateTime)
-    message_count = db.Column(db.Integer, nullable=False, default=0)
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     tags = db.Column(db.JSON, default=[])
     conversation_metadata = db.Column(db.JSON, default={})
     assigned_to = db.Column(db.String(36), db.ForeignKey('users.id'))
@@ -28,6 +28,14 @@ class Conversation(db.Model):
                               cascade='all, delete-orphan', order_by='Message.timestamp')
     assigned_user = db.relationship('User', foreign_keys=[assigned_to])
     
+    __table_args__ = (
+        # Serves the per-chatbot conversation list ordered by recency (NULLS LAST matches its
+        # ORDER BY); SQLite cannot declare null ordering in an index, so it is Postgres-only
+        db.Index('idx_conversations_chatbot_id_status_last_message_at',
+                 'chatbot_id', 'status', db.text('last_message_at DESC NULLS LAST'),
+                 db.text('id DESC')).ddl_if(dialect='postgresql'),
+    )
+    
     def __init__(self, chatbot_id, customer_phone, **kwargs):
         self.chatbot_id = chatbot_id
         self.customer_phone = customer_phone
@@ -77,10 +85,17 @@ class Conversation(db.Model):
             **message_data
         )
         
+        if not message.timestamp:
+            message.timestamp = datetime.utcnow()
+        
         db.session.add(message)
         
-        # Update conversation metadata
-        self.message_count += 1
+        # Update conversation metadata; persisted rows are incremented in SQL so
+        # concurrent messages cannot overwrite each other's count
+        if db.inspect(self).persistent:
+            self.message_count = Conversation.message_count + 1
+        else:
+            self.message_count = (self.message_count or 0) + 1
         self.last_message_at = message.timestamp
         self.updated_at = datetime.utcnow()
         
@@ -110,28 +125,29 @@ class Conversation(db.Model):
     
     def add_tag(self, tag):
         """Add a tag to the conversation"""
-        if not self.tags:
-            self.tags = []
-        
-        if tag not in self.tags:
-            self.tags.append(tag)
+        # JSON columns only notice reassignment, not in-place changes
+        if tag not in (self.tags or []):
+            self.tags = [*(self.tags or []), tag]
             self.updated_at = datetime.utcnow()
     
     def remove_tag(self, tag):
         """Remove a tag from the conversation"""
         if self.tags and tag in self.tags:
-            self.tags.remove(tag)
+            self.tags = [existing for existing in self.tags if existing != tag]
             self.updated_at = datetime.utcnow()
     
     def update_metadata(self, new_metadata):
         """Update conversation metadata"""
-        if self.conversation_metadata:
-            self.conversation_metadata.update(new_metadata)
-        else:
-            self.conversation_metadata = new_metadata
-        
+        self.conversation_metadata = {**(self.conversation_metadata or {}), **(new_metadata or {})}
         self.updated_at = datetime.utcnow()
     
+    @staticmethod
+    def touch(conversation_id):
+        """Bump updated_at after one of the conversation's messages changes"""
+        Conversation.query.filter_by(id=conversation_id).update(
+            {'updated_at': datetime.utcnow()}, synchronize_session=False
+        )
+    
     def get_duration_minutes(self):
         """Get conversation duration in minutes"""
         if not self.ended_at:
@@ -165,13 +181,29 @@ class Conversation(db.Model):
             status='open'
         ).first()
     
+    @staticmethod
+    def find_by_id_for_user(conversation_id, user_id):
+        """Find a conversation, with its chatbot, only if the user can access the chatbot's company"""
+        from sqlalchemy.orm import contains_eager
+        from .chatbot import Chatbot
+        
+        return Conversation.query.join(
+            Chatbot, Chatbot.id == Conversation.chatbot_id
+        ).options(
+            contains_eager(Conversation.chatbot)
+        ).filter(
+            Conversation.id == conversation_id,
+            Chatbot.deleted_at.is_(None),
+            Chatbot._user_access_filter(user_id)
+        ).first()
+    
     @staticmethod
     def find_active_conversations(chatbot_id):
         """Find all active conversations for a chatbot"""
         return Conversation.query.filter_by(
             chatbot_id=chatbot_id,
             status='open'
-        ).order_by(Conversation.last_message_at.desc()).all()
+        ).order_by(Conversation.last_message_at.desc().nullslast()).all()
     
     def __repr__(self):
         return f'<Conversation {self.id} - {self.customer_phone}>'
@@ -200,6 +232,20 @@ class Message(db.Model):
     message_metadata = db.Column(db.JSON, default={})
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Serves per-conversation message pages, newest first with an id tie-breaker for keyset paging
+        db.Index('idx_messages_conversation_id_timestamp',
+                 'conversation_id', db.text('timestamp DESC'), db.text('id DESC')),
+    )
+    
+    # Columns serialized by to_dict(), in order; list endpoints select just these
+    DICT_FIELDS = (
+        'id', 'conversation_id', 'whatsapp_message_id', 'direction', 'type', 'content',
+        'media_url', 'media_type', 'media_size', 'sender_phone', 'sender_name', 'timestamp',
+        'delivered_at', 'read_at', 'failed_at', 'error_message', 'message_metadata', 'created_at'
+    )
+    DATETIME_FIELDS = ('timestamp', 'delivered_at', 'read_at', 'failed_at', 'created_at')
+    
     def __init__(self, conversation_id, direction, type='text', **kwargs):
         self.conversation_id = conversation_id
         self.direction = direction
@@ -279,12 +325,106 @@ class Message(db.Model):
         return Message.query.filter_by(whatsapp_message_id=whatsapp_message_id).first()
     
     @staticmethod
-    def get_conversation_messages(conversation_id, limit=50, offset=0):
-        """Get messages for a conversation with pagination"""
-        return Message.query.filter_by(
-            conversation_id=conversation_id
-        ).order_by(Message.timestamp.desc()).offset(offset).limit(limit).all()
+    def in_chronological_order(latest_query, as_rows=False):
+        """Re-sort a newest-first (LIMITed) message query oldest-first in SQL
+        
+        With `as_rows`, select plain column rows for row_to_dict() instead of Message objects.
+        """
+        latest = db.aliased(Message, latest_query.subquery())
+        entities = [getattr(latest, field) for field in Message.DICT_FIELDS] if as_rows else [latest]
+        return db.session.query(*entities).order_by(latest.timestamp, latest.id)
+    
+    @staticmethod
+    def row_to_dict(row):
+        """Convert a DICT_FIELDS column row to the same dictionary as to_dict(), without loading a Message"""
+        data = row._asdict()
+        for field in Message.DATETIME_FIELDS:
+            value = data[field]
+            data[field] = value.isoformat() if value else None
+        data['message_metadata'] = data['message_metadata'] or {}
+        return data
+    
+    @staticmethod
+    def get_conversation_messages(conversation_id, limit=50, offset=0, as_rows=False):
+        """Get a page of a conversation's latest messages, oldest first"""
+        return Message.in_chronological_order(
+            Message.query.filter_by(
+                conversation_id=conversation_id
+            ).order_by(Message.timestamp.desc(), Message.id.desc()).offset(offset).limit(limit),
+            as_rows=as_rows
+        ).all()
     
     def __repr__(self):
         return f'<Message {self.id} - {self.type} - {self.direction}>'
 
+
+
+# Keep the denormalized counters on Chatbot in step with conversation and message rows
+# (updated_at is pinned so counter bumps do not count as chatbot edits)
+def _chatbots_table():
+    from .chatbot import Chatbot
+    return Chatbot.__table__
+
+@db.event.listens_for(Conversation, 'after_insert')
+def _increment_chatbot_conversations(mapper, connection, target):
+    chatbots = _chatbots_table()
+    connection.execute(
+        chatbots.update().where(chatbots.c.id == target.chatbot_id).values(
+            total_conversations=chatbots.c.total_conversations + 1,
+            updated_at=chatbots.c.updated_at
+        )
+    )
+
+@db.event.listens_for(Conversation, 'after_delete')
+def _decrement_chatbot_conversations(mapper, connection, target):
+    chatbots = _chatbots_table()
+    connection.execute(
+        chatbots.update().where(chatbots.c.id == target.chatbot_id).values(
+            total_conversations=chatbots.c.total_conversations - 1,
+            updated_at=chatbots.c.updated_at
+        )
+    )
+
+@db.event.listens_for(Message, 'after_insert')
+def _increment_chatbot_messages(mapper, connection, target):
+    chatbots = _chatbots_table()
+    conversation_chatbot = db.select(Conversation.chatbot_id).where(
+        Conversation.id == target.conversation_id
+    ).scalar_subquery()
+    timestamp = target.timestamp or datetime.utcnow()
+    connection.execute(
+        chatbots.update().where(chatbots.c.id == conversation_chatbot).values(
+            total_messages=chatbots.c.total_messages + 1,
+            last_message_at=db.case(
+                (chatbots.c.last_message_at >= timestamp, chatbots.c.last_message_at),
+                else_=timestamp
+            ),
+            updated_at=chatbots.c.updated_at
+        )
+    )
+
+@db.event.listens_for(Message, 'after_delete')
+def _decrement_conversation_messages(mapper, connection, target):
+    conversations = Conversation.__table__
+    connection.execute(
+        conversations.update().where(conversations.c.id == target.conversation_id).values(
+            message_count=db.case(
+                (conversations.c.message_count > 0, conversations.c.message_count - 1),
+                else_=0
+            ),
+            updated_at=conversations.c.updated_at
+        )
+    )
+
+@db.event.listens_for(Message, 'after_delete')
+def _decrement_chatbot_messages(mapper, connection, target):
+    chatbots = _chatbots_table()
+    conversation_chatbot = db.select(Conversation.chatbot_id).where(
+        Conversation.id == target.conversation_id
+    ).scalar_subquery()
+    connection.execute(
+        chatbots.update().where(chatbots.c.id == conversation_chatbot).values(
+            total_messages=chatbots.c.total_messages - 1,
+            updated_at=chatbots.c.updated_at
+        )
+    )
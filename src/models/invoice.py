@@ -24,6 +24,11 @@ class Invoice(db.Model):
     # Relationships
     company = db.relationship('Company', backref='invoices')
     
+    __table_args__ = (
+        db.Index('idx_invoices_stripe_invoice_id', 'stripe_invoice_id', unique=True),
+        db.Index('idx_invoices_company_id_created_at', 'company_id', 'created_at'),
+    )
+    
     def __init__(self, company_id, subscription_id, amount, **kwargs):
         self.company_id = company_id
         self.subscription_id = subscription_id
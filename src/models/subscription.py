@@ -106,6 +106,11 @@ class Subscription(db.Model):
     usage_tracking = db.relationship('UsageTracking', backref='subscription', lazy=True,
                                     cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('idx_subscriptions_stripe_subscription_id', 'stripe_subscription_id', unique=True),
+        db.Index('idx_subscriptions_company_id_status', 'company_id', 'status'),
+    )
+    
     def __init__(self, company_id, plan_id, **kwargs):
         self.company_id = company_id
         self.plan_id = plan_id
@@ -246,6 +251,11 @@ class Subscription(db.Model):
         if self.status in ['trialing', 'past_due']:
             self.status = 'active'
     
+    @staticmethod
+    def find_by_id(subscription_id):
+        """Find subscription by ID"""
+        return db.session.get(Subscription, subscription_id)
+    
     @staticmethod
     def find_by_company(company_id):
         """Find active subscription for a company"""
@@ -26,8 +26,15 @@ class User(db.Model):
     deleted_at = db.Column(db.DateTime)
     
     # Relationships will be defined after all models are loaded
-    # owned_companies = db.relationship('Company', backref='owner', lazy=True, foreign_keys='Company.owner_id')
-    # company_memberships = db.relationship('CompanyUser', backref='user', lazy=True)
+    owned_companies = db.relationship('Company', backref='owner', lazy=True, foreign_keys='Company.owner_id')
+    # CompanyUser also references users through invited_by, so the join column is explicit
+    company_memberships = db.relationship('CompanyUser', backref='user', lazy=True,
+                                          foreign_keys='CompanyUser.user_id')
+    
+    __table_args__ = (
+        # Case-insensitive email lookups (find_by_email, invites) probe this index
+        db.Index('idx_users_email_lower', db.func.lower(email), unique=True),
+    )
     
     def __init__(self, email, password, first_name, last_name, role='company_user'):
         self.email = email
@@ -79,51 +86,131 @@ class User(db.Model):
             return True
         
         if company_id:
-            # Check company-specific permissions
-            membership = CompanyUser.query.filter_by(
-                user_id=self.id, 
-                company_id=company_id
-            ).first()
-            
-            if membership:
-                permissions = membership.permissions or {}
-                return permissions.get(permission, False)
+            # Company permissions come from the cached membership row (owners have all of them)
+            from src.services.membership_cache import membership_cache
+            return membership_cache.has_permission(self, company_id, permission)
         
         return False
     
-    def get_companies(self):
-        """Get all companies the user has access to"""
+    def get_companies(self, with_relationships=False):
+        """Get all companies the user has access to (`with_relationships` eager-loads what Company.to_dict needs)"""
+        from sqlalchemy.orm import contains_eager, selectinload
+        from .company import Company
+        from .subscription import Subscription
+        
+        company_options = [
+            selectinload(Company.chatbots),
+            selectinload(Company.subscriptions).selectinload(Subscription.plan),
+            selectinload(Company.user_memberships)
+        ] if with_relationships else []
+        
         companies = []
         
         # Add owned companies
-        for company in self.owned_companies:
-            if not company.deleted_at:
-                companies.append({
-                    'company': company,
-                    'role': 'owner',
-                    'permissions': {}
-                })
+        owned_companies = Company.query.options(*company_options).filter_by(
+            owner_id=self.id,
+            deleted_at=None
+        ).all()
+        for company in owned_companies:
+            companies.append({
+                'company': company,
+                'role': 'owner',
+                'permissions': {}
+            })
         
-        # Add member companies
-        for membership in self.company_memberships:
-            if not membership.company.deleted_at:
-                companies.append({
-                    'company': membership.company,
-                    'role': membership.role,
-                    'permissions': membership.permissions or {}
-                })
+        # Add member companies, loading each membership's company in the same query
+        memberships = CompanyUser.query.join(
+            Company, Company.id == CompanyUser.company_id
+        ).options(
+            contains_eager(CompanyUser.company).options(*company_options)
+        ).filter(
+            CompanyUser.user_id == self.id,
+            Company.deleted_at.is_(None)
+        ).all()
+        for membership in memberships:
+            companies.append({
+                'company': membership.company,
+                'role': membership.role,
+                'permissions': membership.permissions or {}
+            })
         
         return companies
     
+    def get_company_ids(self):
+        """Get the IDs of all companies the user has access to, without loading the companies"""
+        from .company import Company
+        
+        owned = db.select(Company.id).where(
+            Company.owner_id == self.id,
+            Company.deleted_at.is_(None)
+        )
+        member = db.select(Company.id).join(
+            CompanyUser, CompanyUser.company_id == Company.id
+        ).where(
+            CompanyUser.user_id == self.id,
+            Company.deleted_at.is_(None)
+        )
+        return frozenset(db.session.execute(db.union(owned, member)).scalars())
+    
     @staticmethod
     def find_by_email(email):
-        """Find user by email address"""
-        return User.query.filter_by(email=email, deleted_at=None).first()
+        """Find user by email address (case-insensitive)"""
+        return User.query.filter(
+            db.func.lower(User.email) == email.lower().strip(),
+            User.deleted_at.is_(None)
+        ).first()
+    
+    @staticmethod
+    def resolve_for_invite(email, company_id):
+        """Resolve an invitee's ID and whether they already belong to the company in one query"""
+        row = db.session.query(User.id, CompanyUser.id).outerjoin(
+            CompanyUser,
+            (CompanyUser.user_id == User.id) & (CompanyUser.company_id == company_id)
+        ).filter(
+            db.func.lower(User.email) == email.lower(),
+            User.deleted_at.is_(None)
+        ).first()
+        
+        if not row:
+            return None, False
+        
+        return row[0], row[1] is not None
     
     @staticmethod
     def find_by_id(user_id):
-        """Find user by ID"""
-        return User.query.filter_by(id=user_id, deleted_at=None).first()
+        """Find user by ID, checking the session identity map first"""
+        if not user_id:
+            return None
+        user = db.session.get(User, user_id)
+        return user if user and not user.deleted_at else None
+    
+    def has_company_access(self, company_id):
+        """Check if user owns or belongs to a company with a single EXISTS query"""
+        return User.user_has_company_access(self.id, company_id)
+    
+    @staticmethod
+    def user_has_company_access(user_id, company_id):
+        """Check by ID that a live user owns or belongs to a company, without loading the user"""
+        from sqlalchemy import or_
+        from .company import Company
+        
+        is_member = db.session.query(CompanyUser.id).filter(
+            CompanyUser.company_id == Company.id,
+            CompanyUser.user_id == user_id
+        ).exists()
+        user_active = db.session.query(User.id).filter(
+            User.id == user_id,
+            User.deleted_at.is_(None)
+        ).exists()
+        
+        return db.session.query(
+            db.session.query(Company.id).filter(
+                Company.id == company_id,
+                Company.deleted_at.is_(None),
+                or_(Company.owner_id == user_id, is_member),
+                user_active
+            ).exists()
+        ).scalar()
     
     def __repr__(self):
         return f'<User {self.email}>'
@@ -139,7 +226,7 @@ class CompanyUser(db.Model):
     role = db.Column(db.String(50), nullable=False, default='member')
     permissions = db.Column(db.JSON, default={})
     invited_by = db.Column(db.String(36), db.ForeignKey('users.id'))
-    invited_at = db.Column(db.DateTime)
+    invited_at = db.Column(db.DateTime, server_default=db.func.now())
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
@@ -147,7 +234,11 @@ class CompanyUser(db.Model):
     company = db.relationship('Company', backref='user_memberships')
     inviter = db.relationship('User', foreign_keys=[invited_by])
     
-    __table_args__ = (db.UniqueConstraint('company_id', 'user_id'),)
+    __table_args__ = (
+        db.UniqueConstraint('company_id', 'user_id'),
+        # Serves "which companies is this user in" lookups; the unique constraint covers company-first
+        db.Index('idx_company_users_user_id_company_id', 'user_id', 'company_id', unique=True),
+    )
     
     def to_dict(self):
         """Convert company user relationship to dictionary"""
@@ -0,0 +1,64 @@
+from flask import g, jsonify, request
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from functools import wraps
+
+from src.models.user import User
+from src.models.chatbot import Chatbot
+from src.models.conversation import Conversation
+
+def current_user():
+    """Get the user for the current JWT, loaded at most once per request"""
+    if '_current_user' not in g:
+        g._current_user = User.find_by_id(get_jwt_identity())
+    return g._current_user
+
+def current_user_active():
+    """Check the current user is active from the access token's claim, loading the user only for older tokens"""
+    active = get_jwt().get('active')
+    if active is None:
+        # Tokens issued before the claim existed
+        user = current_user()
+        active = bool(user and user.is_active)
+    return active
+
+def require_chatbot_access(view=None, *, lookup_by='id', arg='chatbot_id', with_company=False, load=True):
+    """Load the chatbot named by the `arg` URL argument or JSON body field, check access and pass it to the view as `chatbot`
+    
+    `lookup_by` is the Chatbot column `arg` is matched against; use bare or with keyword arguments.
+    With `load=False` only access is checked (an EXISTS query) and the view gets no `chatbot`.
+    """
+    if view is None:
+        return lambda view: require_chatbot_access(
+            view, lookup_by=lookup_by, arg=arg, with_company=with_company, load=load
+        )
+    
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        value = kwargs[arg] if arg in kwargs else (request.get_json(silent=True) or {}).get(arg)
+        if not value:
+            return jsonify({'error': f'{arg} is required'}), 400
+        
+        if not load:
+            if not Chatbot.exists_for_user(get_jwt_identity(), **{lookup_by: value}):
+                return jsonify({'error': 'Chatbot not found'}), 404
+            return view(*args, **kwargs)
+        
+        # Lookup and access check in one query; no access is reported as not found
+        chatbot = Chatbot.find_for_user(get_jwt_identity(), with_company=with_company, **{lookup_by: value})
+        if not chatbot:
+            return jsonify({'error': 'Chatbot not found'}), 404
+        
+        return view(*args, chatbot=chatbot, **kwargs)
+    return wrapper
+
+def require_conversation_access(view):
+    """Load the `conversation_id` URL argument with its chatbot, check access and pass it as `conversation`"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Lookup, chatbot and access check in one query; no access is reported as not found
+        conversation = Conversation.find_by_id_for_user(kwargs['conversation_id'], get_jwt_identity())
+        if not conversation:
+            return jsonify({'error': 'Conversation not found'}), 404
+        
+        return view(*args, conversation=conversation, **kwargs)
+    return wrapper
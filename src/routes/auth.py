@@ -13,6 +13,10 @@ auth_bp = Blueprint('auth', __name__)
 # JWT token blacklist (in production, use Redis)
 blacklisted_tokens = set()
 
+def user_token_claims(user):
+    """Claims embedded in access tokens so hot paths can skip loading the user"""
+    return {'active': user.is_active}
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     """Register a new user"""
@@ -61,6 +65,7 @@ def register():
         # Create tokens
         access_token = create_access_token(
             identity=user.id,
+            additional_claims=user_token_claims(user),
             expires_delta=timedelta(hours=current_app.config.get('JWT_ACCESS_TOKEN_EXPIRES', 1))
         )
         refresh_token = create_refresh_token(
@@ -119,6 +124,7 @@ def login():
         # Create tokens
         access_token = create_access_token(
             identity=user.id,
+            additional_claims=user_token_claims(user),
             expires_delta=timedelta(hours=current_app.config.get('JWT_ACCESS_TOKEN_EXPIRES', 1))
         )
         refresh_token = create_refresh_token(
@@ -177,6 +183,7 @@ def refresh():
         # Create new access token
         access_token = create_access_token(
             identity=user_id,
+            additional_claims=user_token_claims(user),
             expires_delta=timedelta(hours=current_app.config.get('JWT_ACCESS_TOKEN_EXPIRES', 1))
         )
         
@@ -1,18 +1,29 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, timedelta
+from sqlalchemy import update
+from functools import wraps
 import json
+import time
 
 from src.models import db
 from src.models.user import User
 from src.models.company import Company
 from src.models.subscription import Subscription, SubscriptionPlan
 from src.models.invoice import Invoice
-from src.models.analytics import AnalyticsEvent, AnalyticsEventTypes
+from src.models.analytics import AnalyticsEventTypes
 from src.services.stripe_service import stripe_service
+from src.services.analytics_queue import analytics_queue
 
 billing_bp = Blueprint('billing', __name__)
 
+# Subscription statuses that still entitle a company to its plan
+ACTIVE_SUB_STATUSES = ('active', 'trialing', 'past_due')
+
+def _ts(value):
+    """Convert a Stripe epoch timestamp to a naive UTC datetime (None stays None)"""
+    return datetime.utcfromtimestamp(value) if value else None
+
 @billing_bp.route('/plans', methods=['GET'])
 def get_subscription_plans():
     """Get all available subscription plans"""
@@ -63,9 +74,9 @@ def get_current_subscription():
         
         for company_data in user_companies:
             company = company_data['company']
-            subscription = Subscription.query.filter_by(
-                company_id=company.id,
-                status__in=['active', 'trialing', 'past_due']
+            subscription = Subscription.query.filter(
+                Subscription.company_id == company.id,
+                Subscription.status.in_(ACTIVE_SUB_STATUSES)
             ).first()
             
             if subscription:
@@ -133,9 +144,9 @@ def create_subscription():
             return jsonify({'error': 'Invalid subscription plan'}), 400
         
         # Check if company already has an active subscription
-        existing_subscription = Subscription.query.filter_by(
-            company_id=company_id,
-            status__in=['active', 'trialing', 'past_due']
+        existing_subscription = Subscription.query.filter(
+            Subscription.company_id == company_id,
+            Subscription.status.in_(ACTIVE_SUB_STATUSES)
         ).first()
         
         if existing_subscription:
@@ -174,17 +185,17 @@ def create_subscription():
             stripe_customer_id=stripe_customer_id,
             stripe_subscription_id=stripe_subscription.id,
             status='incomplete',
-            current_period_start=datetime.utcfromtimestamp(stripe_subscription.current_period_start),
-            current_period_end=datetime.utcfromtimestamp(stripe_subscription.current_period_end),
-            trial_start=datetime.utcfromtimestamp(stripe_subscription.trial_start) if stripe_subscription.trial_start else None,
-            trial_end=datetime.utcfromtimestamp(stripe_subscription.trial_end) if stripe_subscription.trial_end else None
+            current_period_start=_ts(stripe_subscription.current_period_start),
+            current_period_end=_ts(stripe_subscription.current_period_end),
+            trial_start=_ts(stripe_subscription.trial_start),
+            trial_end=_ts(stripe_subscription.trial_end)
         )
         
         db.session.add(subscription)
         db.session.commit()
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=company_id,
             event_name=AnalyticsEventTypes.SUBSCRIPTION_CREATED,
             user_id=user_id,
@@ -197,7 +208,6 @@ def create_subscription():
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent')
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Subscription created successfully',
@@ -210,7 +220,7 @@ def create_subscription():
         current_app.logger.error(f"Create subscription error: {str(e)}")
         return jsonify({'error': 'Failed to create subscription'}), 500
 
-@billing_bp.route('/subscriptions/<int:subscription_id>/change-plan', methods=['POST'])
+@billing_bp.route('/subscriptions/<subscription_id>/change-plan', methods=['POST'])
 @jwt_required()
 def change_subscription_plan(subscription_id):
     """Change subscription plan"""
@@ -259,16 +269,21 @@ def change_subscription_plan(subscription_id):
         )
         
         # Update local subscription
-        old_plan_name = subscription.plan.name
+        old_plan = subscription.plan
+        old_plan_name = old_plan.name
+        is_upgrade = new_plan.price_monthly >= old_plan.price_monthly
         subscription.plan_id = new_plan_id
         subscription.updated_at = datetime.utcnow()
         
         db.session.commit()
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=subscription.company_id,
-            event_name=AnalyticsEventTypes.SUBSCRIPTION_UPDATED,
+            event_name=(
+                AnalyticsEventTypes.SUBSCRIPTION_UPGRADED if is_upgrade
+                else AnalyticsEventTypes.SUBSCRIPTION_DOWNGRADED
+            ),
             user_id=user_id,
             event_data={
                 'old_plan_name': old_plan_name,
@@ -276,7 +291,6 @@ def change_subscription_plan(subscription_id):
                 'proration_amount': proration_amount
             }
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Subscription plan changed successfully',
@@ -289,7 +303,7 @@ def change_subscription_plan(subscription_id):
         current_app.logger.error(f"Change subscription plan error: {str(e)}")
         return jsonify({'error': 'Failed to change subscription plan'}), 500
 
-@billing_bp.route('/subscriptions/<int:subscription_id>/cancel', methods=['POST'])
+@billing_bp.route('/subscriptions/<subscription_id>/cancel', methods=['POST'])
 @jwt_required()
 def cancel_subscription(subscription_id):
     """Cancel subscription"""
@@ -321,22 +335,23 @@ def cancel_subscription(subscription_id):
         )
         
         # Update local subscription
+        now = datetime.utcnow()
         if immediate:
-            subscription.status = 'canceled'
-            subscription.canceled_at = datetime.utcnow()
+            subscription.status = 'cancelled'
+            subscription.cancelled_at = now
         else:
             subscription.cancel_at_period_end = True
-            subscription.canceled_at = datetime.utcfromtimestamp(stripe_subscription.canceled_at) if stripe_subscription.canceled_at else None
+            subscription.cancelled_at = _ts(stripe_subscription.canceled_at)
         
         subscription.cancellation_reason = reason
-        subscription.updated_at = datetime.utcnow()
+        subscription.updated_at = now
         
         db.session.commit()
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=subscription.company_id,
-            event_name=AnalyticsEventTypes.SUBSCRIPTION_CANCELED,
+            event_name=AnalyticsEventTypes.SUBSCRIPTION_CANCELLED,
             user_id=user_id,
             event_data={
                 'immediate': immediate,
@@ -344,7 +359,6 @@ def cancel_subscription(subscription_id):
                 'plan_name': subscription.plan.name
             }
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Subscription canceled successfully',
@@ -514,9 +528,9 @@ def get_usage_statistics():
             return jsonify({'error': 'Company not found'}), 404
         
         # Get current subscription
-        subscription = Subscription.query.filter_by(
-            company_id=company_id,
-            status__in=['active', 'trialing', 'past_due']
+        subscription = Subscription.query.filter(
+            Subscription.company_id == company_id,
+            Subscription.status.in_(ACTIVE_SUB_STATUSES)
         ).first()
         
         if not subscription:
@@ -555,19 +569,10 @@ def handle_stripe_webhook():
         
         current_app.logger.info(f"Received Stripe webhook: {event['type']}")
         
-        # Handle different event types
-        if event['type'] == 'customer.subscription.created':
-            handle_subscription_created(event['data']['object'])
-        elif event['type'] == 'customer.subscription.updated':
-            handle_subscription_updated(event['data']['object'])
-        elif event['type'] == 'customer.subscription.deleted':
-            handle_subscription_deleted(event['data']['object'])
-        elif event['type'] == 'invoice.payment_succeeded':
-            handle_invoice_payment_succeeded(event['data']['object'])
-        elif event['type'] == 'invoice.payment_failed':
-            handle_invoice_payment_failed(event['data']['object'])
-        elif event['type'] == 'customer.subscription.trial_will_end':
-            handle_trial_will_end(event['data']['object'])
+        # Dispatch to the handler registered for this event type
+        handler = WEBHOOK_HANDLERS.get(event['type'])
+        if handler:
+            handler(event['data']['object'])
         
         return jsonify({'status': 'success'}), 200
         
@@ -578,61 +583,72 @@ def handle_stripe_webhook():
 def handle_subscription_created(stripe_subscription):
     """Handle subscription created event"""
     try:
-        subscription = Subscription.query.filter_by(
-            stripe_subscription_id=stripe_subscription['id']
-        ).first()
+        result = db.session.execute(
+            update(Subscription)
+            .where(Subscription.stripe_subscription_id == stripe_subscription['id'])
+            .values(
+                status=stripe_subscription['status'],
+                updated_at=datetime.utcnow()
+            )
+        )
+        db.session.commit()
         
-        if subscription:
-            subscription.status = stripe_subscription['status']
-            subscription.updated_at = datetime.utcnow()
-            db.session.commit()
-            
-            current_app.logger.info(f"Updated subscription status: {subscription.id}")
+        if result.rowcount:
+            current_app.logger.info(f"Updated subscription status: {stripe_subscription['id']}")
     except Exception as e:
         current_app.logger.error(f"Handle subscription created error: {str(e)}")
 
 def handle_subscription_updated(stripe_subscription):
     """Handle subscription updated event"""
     try:
-        subscription = Subscription.query.filter_by(
-            stripe_subscription_id=stripe_subscription['id']
-        ).first()
+        values = {
+            'status': stripe_subscription['status'],
+            'current_period_start': _ts(stripe_subscription['current_period_start']),
+            'current_period_end': _ts(stripe_subscription['current_period_end']),
+            'updated_at': datetime.utcnow()
+        }
         
-        if subscription:
-            subscription.status = stripe_subscription['status']
-            subscription.current_period_start = datetime.utcfromtimestamp(stripe_subscription['current_period_start'])
-            subscription.current_period_end = datetime.utcfromtimestamp(stripe_subscription['current_period_end'])
-            subscription.updated_at = datetime.utcnow()
-            
-            if stripe_subscription.get('canceled_at'):
-                subscription.canceled_at = datetime.utcfromtimestamp(stripe_subscription['canceled_at'])
-            
-            db.session.commit()
-            
-            current_app.logger.info(f"Updated subscription: {subscription.id}")
+        canceled_at = _ts(stripe_subscription.get('canceled_at'))
+        if canceled_at:
+            values['cancelled_at'] = canceled_at
+        
+        result = db.session.execute(
+            update(Subscription)
+            .where(Subscription.stripe_subscription_id == stripe_subscription['id'])
+            .values(**values)
+        )
+        db.session.commit()
+        
+        if result.rowcount:
+            current_app.logger.info(f"Updated subscription: {stripe_subscription['id']}")
     except Exception as e:
         current_app.logger.error(f"Handle subscription updated error: {str(e)}")
 
 def handle_subscription_deleted(stripe_subscription):
     """Handle subscription deleted event"""
     try:
-        subscription = Subscription.query.filter_by(
-            stripe_subscription_id=stripe_subscription['id']
-        ).first()
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(Subscription)
+            .where(Subscription.stripe_subscription_id == stripe_subscription['id'])
+            .values(
+                status='cancelled',
+                cancelled_at=now,
+                updated_at=now
+            )
+        )
+        db.session.commit()
         
-        if subscription:
-            subscription.status = 'canceled'
-            subscription.canceled_at = datetime.utcnow()
-            subscription.updated_at = datetime.utcnow()
-            db.session.commit()
-            
-            current_app.logger.info(f"Canceled subscription: {subscription.id}")
+        if result.rowcount:
+            current_app.logger.info(f"Canceled subscription: {stripe_subscription['id']}")
     except Exception as e:
         current_app.logger.error(f"Handle subscription deleted error: {str(e)}")
 
 def handle_invoice_payment_succeeded(stripe_invoice):
     """Handle successful invoice payment"""
     try:
+        paid_at = _ts(stripe_invoice['status_transitions']['paid_at'])
+        
         # Create or update invoice record
         invoice = Invoice.query.filter_by(
             stripe_invoice_id=stripe_invoice['id']
@@ -652,12 +668,12 @@ def handle_invoice_payment_succeeded(stripe_invoice):
                     amount=stripe_invoice['amount_paid'],
                     currency=stripe_invoice['currency'],
                     status='paid',
-                    paid_at=datetime.utcfromtimestamp(stripe_invoice['status_transitions']['paid_at'])
+                    paid_at=paid_at
                 )
                 db.session.add(invoice)
         else:
             invoice.status = 'paid'
-            invoice.paid_at = datetime.utcfromtimestamp(stripe_invoice['status_transitions']['paid_at'])
+            invoice.paid_at = paid_at
         
         db.session.commit()
         current_app.logger.info(f"Processed successful payment for invoice: {stripe_invoice['id']}")
@@ -697,3 +713,27 @@ def handle_trial_will_end(stripe_subscription):
     except Exception as e:
         current_app.logger.error(f"Handle trial will end error: {str(e)}")
 
+def _timed(event_type, handler):
+    """Wrap a webhook handler so its latency is logged per event type"""
+    @wraps(handler)
+    def wrapper(payload):
+        started = time.perf_counter()
+        try:
+            return handler(payload)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            current_app.logger.info(f"Handled Stripe {event_type} in {elapsed_ms:.1f}ms")
+    return wrapper
+
+# Stripe event type -> handler, built once at import time
+WEBHOOK_HANDLERS = {
+    'customer.subscription.created': handle_subscription_created,
+    'customer.subscription.updated': handle_subscription_updated,
+    'customer.subscription.deleted': handle_subscription_deleted,
+    'invoice.payment_succeeded': handle_invoice_payment_succeeded,
+    'invoice.payment_failed': handle_invoice_payment_failed,
+    'customer.subscription.trial_will_end': handle_trial_will_end,
+}
+
+for _event_type, _handler in WEBHOOK_HANDLERS.items():
+    WEBHOOK_HANDLERS[_event_type] = _timed(_event_type, _handler)
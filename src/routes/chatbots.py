@@ -1,23 +1,64 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime
+from sqlalchemy.orm import selectinload
 
 from src.models import db
-from src.models.user import User
 from src.models.company import Company
 from src.models.chatbot import Chatbot
 from src.models.conversation import Conversation, Message
-from src.models.analytics import AnalyticsEvent, AnalyticsEventTypes
+from src.models.analytics import AnalyticsEventTypes
+from src.routes.access import current_user, require_chatbot_access
+from src.routes.pagination import encode_cursor, keyset_before
+from src.routes.validation import validate_payload
+from src.services.analytics_queue import analytics_queue
+from src.services.cache_service import cache_service
+from src.services.company_cache import company_cache
 
 chatbots_bp = Blueprint('chatbots', __name__)
 
+# Stats tolerate a minute of staleness; cached per (chatbot_id, days)
+STATS_CACHE_TTL = 60
+
+def _stats_cache_prefix(chatbot_id):
+    return f'chatbot_stats:{chatbot_id}:'
+
+# Accepted request fields and their JSON types
+CHATBOT_CREATE_FIELDS = {
+    'company_id': str,
+    'name': str,
+    'description': str,
+    'welcome_message': str,
+    'fallback_message': str,
+    'auto_response_enabled': bool,
+    'human_handoff_enabled': bool,
+    'analytics_enabled': bool,
+    'configuration': dict,
+    'business_hours': dict
+}
+
+CHATBOT_UPDATE_FIELDS = {
+    'name': str,
+    'description': str,
+    'welcome_message': str,
+    'fallback_message': str,
+    'auto_response_enabled': bool,
+    'human_handoff_enabled': bool,
+    'analytics_enabled': bool,
+    'whatsapp_phone_number': str,
+    'whatsapp_phone_number_id': str,
+    'whatsapp_business_account_id': str,
+    'botpress_bot_id': str,
+    'configuration': dict,
+    'business_hours': dict
+}
+
 @chatbots_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_chatbots():
     """Get chatbots for a company"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -31,17 +72,13 @@ def get_chatbots():
             return jsonify({'error': 'Company not found'}), 404
         
         # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if company.id not in user_companies:
+        if not user.has_company_access(company.id):
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get chatbots
-        chatbots = Chatbot.find_by_company(company_id)
+        # Totals come from the counters stored on each chatbot row; open conversations in one grouped query
+        chatbots = Chatbot.find_by_company_with_stats(company_id)
         
-        chatbots_data = []
-        for chatbot in chatbots:
-            chatbot_data = chatbot.to_dict(include_stats=True)
-            chatbots_data.append(chatbot_data)
+        chatbots_data = [chatbot.to_dict(stats=stats) for chatbot, stats in chatbots]
         
         return jsonify({
             'chatbots': chatbots_data,
@@ -49,7 +86,7 @@ def get_chatbots():
         }), 200
         
     except Exception as e:
-        current_app.logger.error(f"Get chatbots error: {str(e)}")
+        current_app.logger.error("Get chatbots error: %s", e)
         return jsonify({'error': 'Failed to get chatbots'}), 500
 
 @chatbots_bp.route('/', methods=['POST'])
@@ -58,39 +95,36 @@ def create_chatbot():
     """Create a new chatbot"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        data = request.get_json()
-        company_id = data.get('company_id')
+        data, error = validate_payload(
+            request.get_json(silent=True), CHATBOT_CREATE_FIELDS, required=('company_id', 'name')
+        )
+        if error:
+            return jsonify({'error': error}), 400
         
-        if not company_id:
-            return jsonify({'error': 'company_id is required'}), 400
+        company_id = data['company_id']
         
         company = Company.find_by_id(company_id)
         if not company:
             return jsonify({'error': 'Company not found'}), 404
         
         # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if company.id not in user_companies:
+        if not user.has_company_access(company.id):
             return jsonify({'error': 'Access denied'}), 403
         
         # Check if company can create more chatbots
         if not company.can_create_chatbot():
             return jsonify({'error': 'Chatbot limit reached for current subscription plan'}), 403
         
-        # Validate required fields
-        if not data.get('name'):
-            return jsonify({'error': 'name is required'}), 400
-        
         # Create chatbot
         chatbot = Chatbot(
             company_id=company_id,
             name=data['name'].strip(),
-            description=data.get('description', '').strip(),
+            description=(data.get('description') or '').strip(),
             welcome_message=data.get('welcome_message'),
             fallback_message=data.get('fallback_message'),
             auto_response_enabled=data.get('auto_response_enabled', True),
@@ -108,9 +142,10 @@ def create_chatbot():
         
         db.session.add(chatbot)
         db.session.commit()
+        company_cache.invalidate(company_id)
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=company_id,
             event_name=AnalyticsEventTypes.CHATBOT_CREATED,
             chatbot_id=chatbot.id,
@@ -122,7 +157,6 @@ def create_chatbot():
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent')
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Chatbot created successfully',
@@ -131,81 +165,40 @@ def create_chatbot():
         
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"Create chatbot error: {str(e)}")
+        current_app.logger.error("Create chatbot error: %s", e)
         return jsonify({'error': 'Failed to create chatbot'}), 500
 
 @chatbots_bp.route('/<chatbot_id>', methods=['GET'])
 @jwt_required()
-def get_chatbot(chatbot_id):
+@require_chatbot_access
+def get_chatbot(chatbot_id, chatbot):
     """Get a specific chatbot"""
     try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        chatbot_data = chatbot.to_dict(include_stats=True)
+        chatbot_data = chatbot.to_dict(stats=chatbot.get_stats())
         
         # Include validation status
-        whatsapp_errors = chatbot.validate_whatsapp_setup()
-        botpress_errors = chatbot.validate_botpress_setup()
-        
-        chatbot_data['validation'] = {
-            'whatsapp_setup_valid': len(whatsapp_errors) == 0,
-            'whatsapp_errors': whatsapp_errors,
-            'botpress_setup_valid': len(botpress_errors) == 0,
-            'botpress_errors': botpress_errors
-        }
+        chatbot_data['validation'] = chatbot.get_setup_validation()
         
         return jsonify({'chatbot': chatbot_data}), 200
         
     except Exception as e:
-        current_app.logger.error(f"Get chatbot error: {str(e)}")
+        current_app.logger.error("Get chatbot error: %s", e)
         return jsonify({'error': 'Failed to get chatbot'}), 500
 
 @chatbots_bp.route('/<chatbot_id>', methods=['PUT'])
 @jwt_required()
-def update_chatbot(chatbot_id):
+@require_chatbot_access
+def update_chatbot(chatbot_id, chatbot):
     """Update a chatbot"""
     try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        data = request.get_json()
+        data, error = validate_payload(request.get_json(silent=True), CHATBOT_UPDATE_FIELDS)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Update allowed fields
-        allowed_fields = [
-            'name', 'description', 'welcome_message', 'fallback_message',
-            'auto_response_enabled', 'human_handoff_enabled', 'analytics_enabled',
-            'whatsapp_phone_number', 'whatsapp_phone_number_id', 
-            'whatsapp_business_account_id', 'botpress_bot_id'
-        ]
-        
-        for field in allowed_fields:
-            if field in data:
-                setattr(chatbot, field, data[field])
+        for field, value in data.items():
+            if field not in ('configuration', 'business_hours'):
+                setattr(chatbot, field, value)
         
         # Update configuration if provided
         if 'configuration' in data:
@@ -215,8 +208,8 @@ def update_chatbot(chatbot_id):
         if 'business_hours' in data:
             chatbot.business_hours = data['business_hours']
         
-        chatbot.updated_at = datetime.utcnow()
         db.session.commit()
+        cache_service.delete_prefix(_stats_cache_prefix(chatbot_id))
         
         return jsonify({
             'message': 'Chatbot updated successfully',
@@ -225,7 +218,7 @@ def update_chatbot(chatbot_id):
         
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"Update chatbot error: {str(e)}")
+        current_app.logger.error("Update chatbot error: %s", e)
         return jsonify({'error': 'Failed to update chatbot'}), 500
 
 @chatbots_bp.route('/<chatbot_id>', methods=['DELETE'])
@@ -234,82 +227,62 @@ def delete_chatbot(chatbot_id):
     """Delete a chatbot (soft delete)"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
         
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
+        # Access check and soft delete in a single UPDATE, without loading the row
+        deleted = Chatbot.soft_delete_for_user(chatbot_id, user_id)
+        if not deleted:
             return jsonify({'error': 'Chatbot not found'}), 404
         
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        # Soft delete the chatbot
-        chatbot.soft_delete()
         db.session.commit()
+        cache_service.delete_prefix(_stats_cache_prefix(chatbot_id))
+        company_cache.invalidate(deleted.company_id)
         
         # Track analytics event
-        AnalyticsEvent.track_event(
-            company_id=chatbot.company_id,
+        analytics_queue.enqueue(
+            company_id=deleted.company_id,
             event_name=AnalyticsEventTypes.CHATBOT_DELETED,
-            chatbot_id=chatbot.id,
+            chatbot_id=chatbot_id,
             user_id=user_id,
             event_data={
-                'chatbot_name': chatbot.name
+                'chatbot_name': deleted.name
             },
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent')
         )
-        db.session.commit()
         
         return jsonify({'message': 'Chatbot deleted successfully'}), 200
         
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"Delete chatbot error: {str(e)}")
+        current_app.logger.error("Delete chatbot error: %s", e)
         return jsonify({'error': 'Failed to delete chatbot'}), 500
 
 @chatbots_bp.route('/<chatbot_id>/deploy', methods=['POST'])
 @jwt_required()
-def deploy_chatbot(chatbot_id):
+@require_chatbot_access
+def deploy_chatbot(chatbot_id, chatbot):
     """Deploy a chatbot"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
         
         # Validate setup before deployment
-        whatsapp_errors = chatbot.validate_whatsapp_setup()
-        botpress_errors = chatbot.validate_botpress_setup()
+        validation = chatbot.get_setup_validation()
         
-        if whatsapp_errors or botpress_errors:
+        if not (validation['whatsapp_setup_valid'] and validation['botpress_setup_valid']):
             return jsonify({
                 'error': 'Chatbot setup is incomplete',
-                'whatsapp_errors': whatsapp_errors,
-                'botpress_errors': botpress_errors
+                'whatsapp_errors': validation['whatsapp_errors'],
+                'botpress_errors': validation['botpress_errors']
             }), 400
         
         # Deploy the chatbot
         chatbot.deploy()
         db.session.commit()
+        cache_service.delete_prefix(_stats_cache_prefix(chatbot_id))
+        company_cache.invalidate(chatbot.company_id)
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=chatbot.company_id,
             event_name=AnalyticsEventTypes.CHATBOT_DEPLOYED,
             chatbot_id=chatbot.id,
@@ -320,7 +293,6 @@ def deploy_chatbot(chatbot_id):
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent')
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Chatbot deployed successfully',
@@ -329,35 +301,25 @@ def deploy_chatbot(chatbot_id):
         
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"Deploy chatbot error: {str(e)}")
+        current_app.logger.error("Deploy chatbot error: %s", e)
         return jsonify({'error': 'Failed to deploy chatbot'}), 500
 
 @chatbots_bp.route('/<chatbot_id>/deactivate', methods=['POST'])
 @jwt_required()
-def deactivate_chatbot(chatbot_id):
+@require_chatbot_access
+def deactivate_chatbot(chatbot_id, chatbot):
     """Deactivate a chatbot"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
         
         # Deactivate the chatbot
         chatbot.deactivate()
         db.session.commit()
+        cache_service.delete_prefix(_stats_cache_prefix(chatbot_id))
+        company_cache.invalidate(chatbot.company_id)
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=chatbot.company_id,
             event_name=AnalyticsEventTypes.CHATBOT_DEACTIVATED,
             chatbot_id=chatbot.id,
@@ -368,7 +330,6 @@ def deactivate_chatbot(chatbot_id):
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent')
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Chatbot deactivated successfully',
@@ -377,127 +338,95 @@ def deactivate_chatbot(chatbot_id):
         
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"Deactivate chatbot error: {str(e)}")
+        current_app.logger.error("Deactivate chatbot error: %s", e)
         return jsonify({'error': 'Failed to deactivate chatbot'}), 500
 
 @chatbots_bp.route('/<chatbot_id>/conversations', methods=['GET'])
 @jwt_required()
-def get_chatbot_conversations(chatbot_id):
+@require_chatbot_access
+def get_chatbot_conversations(chatbot_id, chatbot):
     """Get conversations for a chatbot"""
     try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
         # Get query parameters
         status = request.args.get('status', 'open')
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 20, type=int), 100)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = max(min(request.args.get('per_page', 20, type=int), 100), 1)
+        cursor = request.args.get('cursor')
         
-        # Query conversations
-        query = Conversation.query.filter_by(chatbot_id=chatbot_id)
+        # Query conversations, loading assigned users up front so to_dict() does not lazy-load per row
+        query = Conversation.query.options(
+            selectinload(Conversation.assigned_user)
+        ).filter_by(chatbot_id=chatbot_id)
         
         if status != 'all':
             query = query.filter_by(status=status)
         
-        # Paginate
-        conversations = query.order_by(Conversation.last_message_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+        query = query.order_by(
+            Conversation.last_message_at.desc().nullslast(),
+            Conversation.id.desc()
         )
         
-        conversations_data = [conv.to_dict() for conv in conversations.items]
-        
-        return jsonify({
-            'conversations': conversations_data,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': conversations.total,
-                'pages': conversations.pages,
-                'has_next': conversations.has_next,
-                'has_prev': conversations.has_prev
-            }
-        }), 200
+        if cursor:
+            # Keyset pagination: seek past the cursor instead of scanning OFFSET rows
+            try:
+                query = query.filter(
+                    keyset_before(Conversation.last_message_at, Conversation.id, cursor)
+                )
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+        else:
+            query = query.offset((page - 1) * per_page)
+        
+        pagination = {'per_page': per_page}
+        if not cursor:
+            pagination.update({'page': page, 'has_prev': page > 1})
+        
+        # Fetch one extra row to learn whether there is a next page without a COUNT(*)
+        rows = query.limit(per_page + 1).yield_per(50)
+        dumps = current_app.json.dumps_bytes
+        
+        def generate():
+            # Stream each conversation as it is read instead of building the whole page in memory
+            yield b'{"conversations":['
+            count = 0
+            last = None
+            has_next = False
+            for conv in rows:
+                if count == per_page:
+                    has_next = True
+                    break
+                yield (b',' if count else b'') + dumps(conv.to_dict())
+                count += 1
+                last = conv
+            
+            pagination['has_next'] = has_next
+            pagination['next_cursor'] = (
+                encode_cursor(last.last_message_at, last.id) if has_next else None
+            )
+            yield b'],"pagination":' + dumps(pagination) + b'}'
+        
+        return Response(stream_with_context(generate()), mimetype='application/json'), 200
         
     except Exception as e:
-        current_app.logger.error(f"Get chatbot conversations error: {str(e)}")
+        current_app.logger.error("Get chatbot conversations error: %s", e)
         return jsonify({'error': 'Failed to get conversations'}), 500
 
 @chatbots_bp.route('/<chatbot_id>/stats', methods=['GET'])
 @jwt_required()
-def get_chatbot_stats(chatbot_id):
+@require_chatbot_access
+def get_chatbot_stats(chatbot_id, chatbot):
     """Get detailed statistics for a chatbot"""
     try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
         # Get query parameters
         days = request.args.get('days', 30, type=int)
         
-        # Get basic stats
-        stats = chatbot.get_stats(days=days)
-        
-        # Get additional statistics
-        from datetime import timedelta
-        from sqlalchemy import func
-        
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Message type distribution
-        message_types = db.session.query(
-            Message.type,
-            func.count(Message.id).label('count')
-        ).join(Conversation).filter(
-            Conversation.chatbot_id == chatbot_id,
-            Message.created_at >= cutoff_date
-        ).group_by(Message.type).all()
-        
-        # Daily conversation counts
-        daily_conversations = db.session.query(
-            func.date(Conversation.started_at).label('date'),
-            func.count(Conversation.id).label('count')
-        ).filter(
-            Conversation.chatbot_id == chatbot_id,
-            Conversation.started_at >= cutoff_date
-        ).group_by(func.date(Conversation.started_at)).all()
-        
-        # Response time analysis (simplified)
-        avg_response_time = 5  # Placeholder - would need more complex query
-        
-        stats.update({
-            'message_type_distribution': [
-                {'type': mt.type, 'count': mt.count}
-                for mt in message_types
-            ],
-            'daily_conversations': [
-                {'date': str(dc.date), 'count': dc.count}
-                for dc in daily_conversations
-            ],
-            'avg_response_time_minutes': avg_response_time
-        })
+        cache_key = f'{_stats_cache_prefix(chatbot_id)}{days}'
+        stats = cache_service.get(cache_key)
+        
+        if stats is None:
+            # Get stats and breakdowns in a single round trip
+            stats = chatbot.get_detailed_stats(days=days)
+            cache_service.set(cache_key, stats, ttl=STATS_CACHE_TTL)
         
         return jsonify({
             'chatbot_id': chatbot_id,
@@ -505,6 +434,6 @@ def get_chatbot_stats(chatbot_id):
         }), 200
         
     except Exception as e:
-        current_app.logger.error(f"Get chatbot stats error: {str(e)}")
+        current_app.logger.error("Get chatbot stats error: %s", e)
         return jsonify({'error': 'Failed to get chatbot statistics'}), 500
 
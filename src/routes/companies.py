@@ -1,14 +1,46 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime
+from sqlalchemy import insert
 
 from src.models import db
-from src.models.user import User
+from src.models.user import User, CompanyUser
 from src.models.company import Company
+from src.models.chatbot import Chatbot
 from src.models.subscription import Subscription, SubscriptionPlan
-from src.models.analytics import AnalyticsEvent, AnalyticsEventTypes
+from src.models.analytics import AnalyticsEventTypes
+from src.services.analytics_queue import analytics_queue
+from src.services.membership_cache import membership_cache
+from src.services.company_cache import company_cache
+from src.routes.compression import gzip_response
+from src.routes.validation import validate_payload
 
 companies_bp = Blueprint('companies', __name__)
+companies_bp.after_request(gzip_response)
+
+# (field, default, transform) for create_company; a None default marks a required field
+COMPANY_CREATE_FIELDS = (
+    ('name', None, str.strip),
+    ('business_type', None, str.strip),
+    ('description', '', str.strip),
+    ('website', '', str.strip),
+    ('phone', '', str.strip),
+    ('email', '', str.strip),
+    ('address', '', str.strip),
+    ('city', '', str.strip),
+    ('country', 'Kazakhstan', None),
+    ('timezone', 'Asia/Almaty', None)
+)
+
+# Company fields a user may change through update_company
+COMPANY_UPDATE_FIELDS = frozenset([
+    'name', 'business_type', 'description', 'website',
+    'phone', 'email', 'address', 'city', 'country',
+    'timezone', 'logo_url'
+])
+
+# JSON body schemas for the invite endpoints (see src/routes/validation.py)
+INVITE_FIELDS = {'email': str, 'role': str, 'permissions': dict}
+BULK_INVITE_FIELDS = {'emails': list, 'role': str, 'permissions': dict}
 
 @companies_bp.route('/', methods=['GET'])
 @jwt_required()
@@ -21,15 +53,17 @@ def get_companies():
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get user's companies
-        companies = user.get_companies()
+        # Get user's companies with the relationships to_dict() reads already loaded
+        companies = user.get_companies(with_relationships=True)
         
-        companies_data = []
-        for comp_info in companies:
-            company_data = comp_info['company'].to_dict(include_relationships=True)
-            company_data['user_role'] = comp_info['role']
-            company_data['user_permissions'] = comp_info['permissions']
-            companies_data.append(company_data)
+        companies_data = [
+            {
+                **comp_info['company'].to_dict(include_relationships=True),
+                'user_role': comp_info['role'],
+                'user_permissions': comp_info['permissions']
+            }
+            for comp_info in companies
+        ]
         
         return jsonify({
             'companies': companies_data,
@@ -51,28 +85,23 @@ def create_company():
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        data = request.get_json()
-        
-        # Validate required fields
-        required_fields = ['name', 'business_type']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'{field} is required'}), 400
+        data = request.get_json(silent=True) or {}
+        
+        # Validate and normalize all fields in one pass
+        fields = {}
+        for field, default, transform in COMPANY_CREATE_FIELDS:
+            value = data.get(field)
+            if value is None or value == '':
+                if default is None:
+                    return jsonify({'error': f'{field} is required'}), 400
+                value = default
+            elif not isinstance(value, str):
+                return jsonify({'error': f'{field} must be a string'}), 400
+            
+            fields[field] = transform(value) if transform else value
         
         # Create company
-        company = Company(
-            name=data['name'].strip(),
-            business_type=data['business_type'].strip(),
-            owner_id=user_id,
-            description=data.get('description', '').strip(),
-            website=data.get('website', '').strip(),
-            phone=data.get('phone', '').strip(),
-            email=data.get('email', '').strip(),
-            address=data.get('address', '').strip(),
-            city=data.get('city', '').strip(),
-            country=data.get('country', 'Kazakhstan'),
-            timezone=data.get('timezone', 'Asia/Almaty')
-        )
+        company = Company(owner_id=user_id, **fields)
         
         db.session.add(company)
         db.session.flush()  # Get company ID
@@ -89,23 +118,26 @@ def create_company():
         
         db.session.commit()
         
+        # Build the response, then hand the connection back before follow-up work
+        company_data = company.to_dict(include_relationships=True)
+        db.session.remove()
+        
         # Track analytics event
-        AnalyticsEvent.track_event(
-            company_id=company.id,
+        analytics_queue.enqueue(
+            company_id=company_data['id'],
             event_name=AnalyticsEventTypes.COMPANY_CREATED,
             user_id=user_id,
             event_data={
-                'company_name': company.name,
-                'business_type': company.business_type
+                'company_name': company_data['name'],
+                'business_type': company_data['business_type']
             },
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent')
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Company created successfully',
-            'company': company.to_dict(include_relationships=True)
+            'company': company_data
         }), 201
         
     except Exception as e:
@@ -124,38 +156,43 @@ def get_company(company_id):
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        company = Company.find_by_id(company_id)
-        if not company:
-            return jsonify({'error': 'Company not found'}), 404
-        
         # Check if user has access to this company
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if company.id not in user_companies:
+        membership = membership_cache.get(user_id, company_id)
+        if not membership:
+            if not Company.find_by_id(company_id):
+                return jsonify({'error': 'Company not found'}), 404
             return jsonify({'error': 'Access denied'}), 403
         
         # Get user's role in this company
-        user_role = 'owner' if company.owner_id == user_id else 'member'
-        
-        company_data = company.to_dict(include_relationships=True)
-        company_data['user_role'] = user_role
-        
-        # Include team members
-        team_members = company.get_team_members()
-        company_data['team_members'] = [
-            {
-                'user': member['user'].to_dict(),
-                'role': member['role'],
-                'permissions': member['permissions'],
-                'joined_at': member['joined_at'].isoformat()
-            }
-            for member in team_members
-        ]
-        
-        # Include usage statistics
-        usage_stats = company.get_usage_stats()
-        company_data['usage_stats'] = usage_stats
-        
-        return jsonify({'company': company_data}), 200
+        user_role = membership['role']
+        
+        cached = company_cache.get(company_id)
+        if cached:
+            company_data, etag = cached['company'], cached['etag']
+        else:
+            company = Company.find_by_id(company_id)
+            if not company:
+                return jsonify({'error': 'Company not found'}), 404
+            
+            company_data = company.to_dict(include_relationships=True)
+            
+            # Include team members
+            company_data['team_members'] = company.get_team_members_data()
+            
+            # Include usage statistics
+            usage_stats = company.get_usage_stats()
+            company_data['usage_stats'] = usage_stats
+            
+            etag = company_cache.set(company_id, company_data)
+        
+        # The role is per user, so it is part of the ETag but not of the cached payload
+        etag = f'{etag}-{user_role}'
+        if etag in request.if_none_match:
+            return '', 304, {'ETag': f'"{etag}"'}
+        
+        response = jsonify({'company': {**company_data, 'user_role': user_role}})
+        response.set_etag(etag)
+        return response, 200
         
     except Exception as e:
         current_app.logger.error(f"Get company error: {str(e)}")
@@ -172,49 +209,47 @@ def update_company(company_id):
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        company = Company.find_by_id(company_id)
-        if not company:
-            return jsonify({'error': 'Company not found'}), 404
-        
-        # Check if user is owner or has permission
-        if company.owner_id != user_id:
-            # Check if user has edit permission
-            if not user.has_permission('edit_company', company_id):
-                return jsonify({'error': 'Access denied'}), 403
+        # Check if user is owner or has edit permission
+        if not membership_cache.has_permission(user, company_id, 'edit_company'):
+            return jsonify({'error': 'Access denied'}), 403
         
         data = request.get_json()
         
-        # Update allowed fields
-        allowed_fields = [
-            'name', 'business_type', 'description', 'website', 
-            'phone', 'email', 'address', 'city', 'country', 
-            'timezone', 'logo_url'
-        ]
+        # Update allowed fields with a single UPDATE, without loading the row first
+        updates = {field: data[field] for field in data.keys() & COMPANY_UPDATE_FIELDS}
+        
+        updated = Company.query.filter(
+            Company.id == company_id,
+            Company.deleted_at.is_(None)
+        ).update(updates, synchronize_session=False)
         
-        for field in allowed_fields:
-            if field in data:
-                setattr(company, field, data[field])
+        if not updated:
+            return jsonify({'error': 'Company not found'}), 404
         
-        company.updated_at = datetime.utcnow()
         db.session.commit()
+        company_cache.invalidate(company_id)
+        company = Company.find_by_id(company_id)
+        
+        # Build the response, then hand the connection back before follow-up work
+        company_data = company.to_dict(include_relationships=True)
+        db.session.remove()
         
         # Track analytics event
-        AnalyticsEvent.track_event(
-            company_id=company.id,
+        analytics_queue.enqueue(
+            company_id=company_data['id'],
             event_name=AnalyticsEventTypes.COMPANY_UPDATED,
             user_id=user_id,
             event_data={
-                'company_name': company.name,
+                'company_name': company_data['name'],
                 'updated_fields': list(data.keys())
             },
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent')
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Company updated successfully',
-            'company': company.to_dict(include_relationships=True)
+            'company': company_data
         }), 200
         
     except Exception as e:
@@ -244,6 +279,8 @@ def delete_company(company_id):
         # Soft delete the company
         company.soft_delete()
         db.session.commit()
+        membership_cache.invalidate(company_id)
+        company_cache.invalidate(company_id)
         
         return jsonify({'message': 'Company deleted successfully'}), 200
         
@@ -267,9 +304,8 @@ def get_company_stats(company_id):
         if not company:
             return jsonify({'error': 'Company not found'}), 404
         
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if company.id not in user_companies:
+        # Check access; owners skip the membership lookup
+        if company.owner_id != user_id and not membership_cache.get(user_id, company.id):
             return jsonify({'error': 'Access denied'}), 403
         
         # Get query parameters
@@ -278,29 +314,37 @@ def get_company_stats(company_id):
         # Get usage statistics
         usage_stats = company.get_usage_stats()
         
-        # Get chatbot statistics
-        chatbots = company.get_active_chatbots()
-        chatbot_stats = []
-        
-        for chatbot in chatbots:
-            stats = chatbot.get_stats(days=days)
-            chatbot_stats.append({
-                'chatbot_id': chatbot.id,
-                'chatbot_name': chatbot.name,
-                **stats
-            })
+        # Get chatbot statistics for all chatbots at once
+        stats_by_chatbot = company.get_chatbot_stats_bulk(days=days)
+        empty_stats = Chatbot._build_stats(0, 0, 0, days)
+        chatbots = db.session.query(Chatbot.id, Chatbot.name).filter(
+            Chatbot.company_id == company.id,
+            Chatbot.status == 'active',
+            Chatbot.deleted_at.is_(None)
+        ).order_by(Chatbot.created_at).execution_options(yield_per=100)
         
         # Get subscription info
         subscription = company.get_current_subscription()
-        subscription_info = subscription.to_dict() if subscription else None
-        
-        return jsonify({
+        summary = {
             'company_id': company_id,
             'usage_stats': usage_stats,
-            'chatbot_stats': chatbot_stats,
-            'subscription': subscription_info,
+            'subscription': subscription.to_dict() if subscription else None,
             'stats_period_days': days
-        }), 200
+        }
+        dumps = current_app.json.dumps_bytes
+        
+        def generate():
+            # Stream one chatbot at a time so memory stays flat for large companies
+            yield b'{"chatbot_stats":['
+            for index, (chatbot_id, chatbot_name) in enumerate(chatbots):
+                yield (b',' if index else b'') + dumps({
+                    'chatbot_id': chatbot_id,
+                    'chatbot_name': chatbot_name,
+                    **stats_by_chatbot.get(chatbot_id, empty_stats)
+                })
+            yield b'],' + dumps(summary)[1:]
+        
+        return Response(stream_with_context(generate()), mimetype='application/json'), 200
         
     except Exception as e:
         current_app.logger.error(f"Get company stats error: {str(e)}")
@@ -321,22 +365,11 @@ def get_team_members(company_id):
         if not company:
             return jsonify({'error': 'Company not found'}), 404
         
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if company.id not in user_companies:
+        # Check access; owners skip the membership lookup
+        if company.owner_id != user_id and not membership_cache.get(user_id, company.id):
             return jsonify({'error': 'Access denied'}), 403
         
-        team_members = company.get_team_members()
-        
-        members_data = [
-            {
-                'user': member['user'].to_dict(),
-                'role': member['role'],
-                'permissions': member['permissions'],
-                'joined_at': member['joined_at'].isoformat()
-            }
-            for member in team_members
-        ]
+        members_data = company.get_team_members_data()
         
         return jsonify({
             'team_members': members_data,
@@ -363,50 +396,51 @@ def invite_team_member(company_id):
             return jsonify({'error': 'Company not found'}), 404
         
         # Check if user can invite (owner or has permission)
-        if company.owner_id != user_id and not user.has_permission('invite_users', company_id):
+        if not membership_cache.has_permission(user, company_id, 'invite_users'):
             return jsonify({'error': 'Access denied'}), 403
         
-        data = request.get_json()
-        email = data.get('email', '').lower().strip()
-        role = data.get('role', 'member')
-        permissions = data.get('permissions', {})
+        data, error = validate_payload(request.get_json(silent=True), INVITE_FIELDS, required=('email',))
+        if error:
+            return jsonify({'error': error}), 400
+        
+        email = data['email'].lower().strip()
+        role = data.get('role') or 'member'
+        permissions = data.get('permissions') or {}
         
         if not email:
             return jsonify({'error': 'Email is required'}), 400
         
-        # Check if user exists
-        invited_user = User.find_by_email(email)
-        if not invited_user:
+        # Check that the user exists and is not already a member
+        invited_user_id, already_member = User.resolve_for_invite(email, company_id)
+        if not invited_user_id:
             return jsonify({'error': 'User not found'}), 404
         
-        # Check if user is already a member
-        from src.models.user import CompanyUser
-        existing_membership = CompanyUser.query.filter_by(
-            company_id=company_id,
-            user_id=invited_user.id
-        ).first()
-        
-        if existing_membership:
+        if already_member:
             return jsonify({'error': 'User is already a member of this company'}), 409
         
         # Create membership
         membership = CompanyUser(
             company_id=company_id,
-            user_id=invited_user.id,
+            user_id=invited_user_id,
             role=role,
             permissions=permissions,
-            invited_by=user_id,
-            invited_at=datetime.utcnow()
+            invited_by=user_id
         )
         
         db.session.add(membership)
         db.session.commit()
+        membership_cache.invalidate(company_id, invited_user_id)
+        company_cache.invalidate(company_id)
         
-        # TODO: Send invitation email
+        # Build the response, then hand the connection back before follow-up work
+        membership_data = membership.to_dict()
+        db.session.remove()
+        
+        # TODO: Send invitation email (queue it; do not hold a DB connection)
         
         return jsonify({
             'message': 'Team member invited successfully',
-            'membership': membership.to_dict()
+            'membership': membership_data
         }), 201
         
     except Exception as e:
@@ -414,3 +448,88 @@ def invite_team_member(company_id):
         current_app.logger.error(f"Invite team member error: {str(e)}")
         return jsonify({'error': 'Failed to invite team member'}), 500
 
+
+# Rows per multi-row INSERT, well under Postgres' 65535 bind-parameter limit
+INVITE_INSERT_CHUNK_SIZE = 1000
+MAX_BULK_INVITES = 10000
+
+@companies_bp.route('/<company_id>/invite_bulk', methods=['POST'])
+@jwt_required()
+def invite_team_members_bulk(company_id):
+    """Invite several existing users to the company at once"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.find_by_id(user_id)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        company = Company.find_by_id(company_id)
+        if not company:
+            return jsonify({'error': 'Company not found'}), 404
+        
+        # Check if user can invite (owner or has permission)
+        if not membership_cache.has_permission(user, company_id, 'invite_users'):
+            return jsonify({'error': 'Access denied'}), 403
+        
+        data, error = validate_payload(request.get_json(silent=True), BULK_INVITE_FIELDS, required=('emails',))
+        if error:
+            return jsonify({'error': error}), 400
+        
+        emails = data['emails']
+        role = data.get('role') or 'member'
+        permissions = data.get('permissions') or {}
+        
+        if len(emails) > MAX_BULK_INVITES:
+            return jsonify({'error': f'At most {MAX_BULK_INVITES} emails can be invited at once'}), 400
+        
+        emails = list(dict.fromkeys(
+            email.lower().strip() for email in emails if isinstance(email, str) and email.strip()
+        ))
+        
+        # Resolve all invitees, then drop existing members, with one query each
+        users_by_email = dict(db.session.query(db.func.lower(User.email), User.id).filter(
+            db.func.lower(User.email).in_(emails),
+            User.deleted_at.is_(None)
+        ).all())
+        
+        existing_member_ids = {
+            member_id for (member_id,) in db.session.query(CompanyUser.user_id).filter(
+                CompanyUser.company_id == company_id,
+                CompanyUser.user_id.in_(users_by_email.values())
+            )
+        } if users_by_email else set()
+        
+        rows = [
+            {
+                'company_id': company_id,
+                'user_id': invited_user_id,
+                'role': role,
+                'permissions': permissions,
+                'invited_by': user_id
+            }
+            for invited_user_id in users_by_email.values()
+            if invited_user_id not in existing_member_ids
+        ]
+        
+        for start in range(0, len(rows), INVITE_INSERT_CHUNK_SIZE):
+            db.session.execute(insert(CompanyUser), rows[start:start + INVITE_INSERT_CHUNK_SIZE])
+        db.session.commit()
+        
+        for row in rows:
+            membership_cache.invalidate(company_id, row['user_id'])
+        company_cache.invalidate(company_id)
+        
+        ids_to_email = {invited_user_id: email for email, invited_user_id in users_by_email.items()}
+        
+        return jsonify({
+            'message': f'{len(rows)} team members invited successfully',
+            'invited': [ids_to_email[row['user_id']] for row in rows],
+            'already_members': [ids_to_email[member_id] for member_id in existing_member_ids],
+            'not_found': [email for email in emails if email not in users_by_email]
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Bulk invite team members error: {str(e)}")
+        return jsonify({'error': 'Failed to invite team members'}), 500
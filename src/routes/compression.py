@@ -0,0 +1,28 @@
+import gzip
+
+from flask import request
+
+# Below this size the gzip header and CPU cost outweigh the savings
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+def gzip_response(response):
+    """after_request hook: gzip JSON responses for clients that accept it"""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or not 200 <= response.status_code < 300
+        or response.mimetype != 'application/json'
+        or 'Content-Encoding' in response.headers
+        or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -1,431 +1,402 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import InternalServerError
 from datetime import datetime
+import hashlib
 
 from src.models import db
 from src.models.user import User
 from src.models.chatbot import Chatbot
 from src.models.conversation import Conversation, Message
 from src.models.analytics import AnalyticsEvent, AnalyticsEventTypes
+from src.routes.access import require_conversation_access
+from src.routes.pagination import encode_cursor, keyset_before
+from src.services.analytics_queue import analytics_queue
+from src.services.outbound_queue import outbound_queue
+from src.services.conversation_cache import conversation_cache
 
 conversations_bp = Blueprint('conversations', __name__)
 
+MAX_TAG_LENGTH = 64
+# Mutation bodies are small; anything larger is rejected before it is parsed
+MAX_BODY_SIZE = 64 * 1024
+
+# Client-facing message for an unexpected failure, by view function
+ERROR_MESSAGES = {
+    'get_conversation': 'Failed to get conversation',
+    'get_conversation_messages': 'Failed to get messages',
+    'send_message': 'Failed to send message',
+    'close_conversation': 'Failed to close conversation',
+    'reopen_conversation': 'Failed to reopen conversation',
+    'assign_conversation': 'Failed to assign conversation',
+    'add_conversation_tag': 'Failed to add tag',
+    'remove_conversation_tag': 'Failed to remove tag',
+    'update_conversation_metadata': 'Failed to update metadata'
+}
+
+@conversations_bp.errorhandler(SQLAlchemyError)
+def handle_database_error(e):
+    """Roll back the failed transaction and report a database error"""
+    db.session.rollback()
+    current_app.logger.error(f"Conversation database error in {request.endpoint}: {str(e)}")
+    return jsonify({'error': _error_message()}), 500
+
+@conversations_bp.errorhandler(InternalServerError)
+def handle_unexpected_error(e):
+    """Report unhandled failures; JWT and other 4xx errors keep their own handlers"""
+    # Flask has already logged the traceback before calling this handler
+    db.session.rollback()
+    return jsonify({'error': _error_message()}), 500
+
+def _error_message():
+    """Pick the client-facing error for the view that failed"""
+    view = (request.endpoint or '').rpartition('.')[2]
+    return ERROR_MESSAGES.get(view, 'Internal server error')
+
+def _read_json_body():
+    """Parse a size-checked JSON object body; returns (data, error_response)"""
+    if request.content_length and request.content_length > MAX_BODY_SIZE:
+        return None, (jsonify({'error': 'Payload too large'}), 413)
+    
+    data = request.get_json(silent=True, cache=False)
+    if not isinstance(data, dict):
+        return None, (jsonify({'error': 'Request body must be a JSON object'}), 400)
+    
+    return data, None
+
+def _mutation_result(conversation, *fields):
+    """Serialize just the fields a mutation changed, or the whole conversation with ?full=true
+    
+    Call before committing: the changed values are still loaded, so no refresh query is needed.
+    """
+    if request.args.get('full', 'false').lower() == 'true':
+        return None
+    
+    result = {'id': conversation.id}
+    for field in (*fields, 'updated_at'):
+        value = getattr(conversation, field)
+        result[field] = value.isoformat() if isinstance(value, datetime) else value
+    return result
+
+def _weak_etag(*parts):
+    """Build a weak ETag from the values a response is derived from"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
 @conversations_bp.route('/<conversation_id>', methods=['GET'])
 @jwt_required()
 def get_conversation(conversation_id):
     """Get a specific conversation with messages"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
+    user_id = get_jwt_identity()
+    
+    conversation_data = conversation_cache.get(conversation_id)
+    if conversation_data:
+        # The cached header names the chatbot; one EXISTS applies the same checks as the uncached
+        # lookup (chatbot, company and user not deleted, user owns or belongs to the company)
+        if not Chatbot.exists_for_user(user_id, id=conversation_data['chatbot']['id']):
+            return jsonify({'error': 'Conversation not found'}), 404
+    else:
+        conversation = Conversation.find_by_id_for_user(conversation_id, user_id)
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
         
-        # Check access through chatbot
         chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        # Get query parameters
-        include_messages = request.args.get('include_messages', 'true').lower() == 'true'
-        message_limit = request.args.get('message_limit', 50, type=int)
-        message_offset = request.args.get('message_offset', 0, type=int)
-        
         conversation_data = conversation.to_dict(include_messages=False)
         
-        if include_messages:
-            messages = Message.get_conversation_messages(
-                conversation_id, 
-                limit=message_limit, 
-                offset=message_offset
-            )
-            conversation_data['messages'] = [msg.to_dict() for msg in reversed(messages)]
-            conversation_data['message_pagination'] = {
-                'limit': message_limit,
-                'offset': message_offset,
-                'total_messages': conversation.message_count
-            }
-        
         # Include chatbot info
         conversation_data['chatbot'] = {
             'id': chatbot.id,
             'name': chatbot.name,
             'company_id': chatbot.company_id
         }
-        
-        return jsonify({'conversation': conversation_data}), 200
-        
-    except Exception as e:
-        current_app.logger.error(f"Get conversation error: {str(e)}")
-        return jsonify({'error': 'Failed to get conversation'}), 500
+        conversation_cache.set(conversation_id, conversation_data)
+    
+    # Get query parameters
+    include_messages = request.args.get('include_messages', 'true').lower() == 'true'
+    message_limit = request.args.get('message_limit', 50, type=int)
+    message_offset = request.args.get('message_offset', 0, type=int)
+    include_total = request.args.get('include_total', 'true').lower() == 'true'
+    
+    # Polling clients get a 304 until the conversation is updated or gains a message
+    etag = _weak_etag(
+        conversation_id, conversation_data['updated_at'],
+        conversation_data['message_count'], request.query_string
+    )
+    if request.if_none_match.contains_weak(etag):
+        return '', 304, {'ETag': f'W/"{etag}"'}
+    
+    # Messages change too often to cache; always read them
+    if include_messages:
+        messages = Message.get_conversation_messages(
+            conversation_id, 
+            limit=message_limit, 
+            offset=message_offset,
+            as_rows=True
+        )
+        conversation_data['messages'] = [Message.row_to_dict(row) for row in messages]
+        conversation_data['message_pagination'] = {
+            'limit': message_limit,
+            'offset': message_offset
+        }
+        if include_total:
+            conversation_data['message_pagination']['total_messages'] = conversation_data['message_count']
+    
+    response = jsonify({'conversation': conversation_data})
+    response.set_etag(etag, weak=True)
+    return response, 200
 
 @conversations_bp.route('/<conversation_id>/messages', methods=['GET'])
 @jwt_required()
-def get_conversation_messages(conversation_id):
+@require_conversation_access
+def get_conversation_messages(conversation_id, conversation):
     """Get messages for a conversation with pagination"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        # Check access
-        chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        # Get query parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 50, type=int), 100)
-        
-        # Query messages with pagination
-        messages = Message.query.filter_by(
-            conversation_id=conversation_id
-        ).order_by(Message.timestamp.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
-        
-        messages_data = [msg.to_dict() for msg in reversed(messages.items)]
-        
-        return jsonify({
-            'messages': messages_data,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': messages.total,
-                'pages': messages.pages,
-                'has_next': messages.has_next,
-                'has_prev': messages.has_prev
-            }
-        }), 200
-        
-    except Exception as e:
-        current_app.logger.error(f"Get conversation messages error: {str(e)}")
-        return jsonify({'error': 'Failed to get messages'}), 500
+    # Get query parameters
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(min(request.args.get('per_page', 50, type=int), 100), 1)
+    cursor = request.args.get('cursor')
+    include_total = request.args.get('include_total', 'false').lower() == 'true'
+    
+    # Newest first, so a page is the most recent messages before the cursor
+    query = Message.query.filter_by(
+        conversation_id=conversation_id
+    ).order_by(Message.timestamp.desc(), Message.id.desc())
+    
+    if cursor:
+        # Keyset pagination: seek past the cursor instead of scanning OFFSET rows
+        try:
+            query = query.filter(keyset_before(Message.timestamp, Message.id, cursor))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    else:
+        query = query.offset((page - 1) * per_page)
+    
+    # Fetch one extra row to learn whether there are older messages without a COUNT(*),
+    # and let the database return the page oldest first
+    messages = Message.in_chronological_order(query.limit(per_page + 1), as_rows=True).all()
+    has_next = len(messages) > per_page
+    if has_next:
+        messages = messages[1:]
+    
+    pagination = {
+        'per_page': per_page,
+        'has_next': has_next,
+        'next_cursor': encode_cursor(messages[0].timestamp, messages[0].id) if has_next else None
+    }
+    if not cursor:
+        pagination.update({'page': page, 'has_prev': page > 1})
+    if include_total:
+        # Read from the maintained counter rather than a COUNT(*) over messages
+        pagination['total'] = conversation.message_count
+    
+    # The page is unchanged while its newest and oldest messages are; skip serializing it
+    etag = _weak_etag(
+        conversation_id, request.query_string, len(messages), has_next,
+        messages[0].id if messages else '', messages[-1].id if messages else '',
+        pagination.get('total', '')
+    )
+    if request.if_none_match.contains_weak(etag):
+        return '', 304, {'ETag': f'W/"{etag}"'}
+    
+    messages_data = [Message.row_to_dict(row) for row in messages]
+    
+    response = jsonify({
+        'messages': messages_data,
+        'pagination': pagination
+    })
+    response.set_etag(etag, weak=True)
+    return response, 200
 
 @conversations_bp.route('/<conversation_id>/messages', methods=['POST'])
 @jwt_required()
-def send_message(conversation_id):
+@require_conversation_access
+def send_message(conversation_id, conversation):
     """Send a message in a conversation"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        # Check access
-        chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        data = request.get_json()
-        
-        # Validate required fields
-        if not data.get('content'):
-            return jsonify({'error': 'Message content is required'}), 400
-        
-        # Create message
-        message_data = {
-            'direction': 'outbound',
-            'type': data.get('type', 'text'),
-            'content': data['content'],
-            'sender_phone': chatbot.whatsapp_phone_number,
-            'sender_name': chatbot.name,
-            'media_url': data.get('media_url'),
-            'media_type': data.get('media_type'),
-            'metadata': data.get('metadata', {})
+    user_id = get_jwt_identity()
+    chatbot = conversation.chatbot
+    
+    data, error = _read_json_body()
+    if error:
+        return error
+    
+    # Validate required fields
+    if not data.get('content'):
+        return jsonify({'error': 'Message content is required'}), 400
+    
+    # Create message
+    message_data = {
+        'direction': 'outbound',
+        'type': data.get('type', 'text'),
+        'content': data['content'],
+        'sender_phone': chatbot.whatsapp_phone_number,
+        'sender_name': chatbot.name,
+        'media_url': data.get('media_url'),
+        'media_type': data.get('media_type'),
+        'metadata': data.get('metadata', {})
+    }
+    
+    message = conversation.add_message(message_data)
+    db.session.commit()
+    conversation_cache.invalidate(conversation_id)
+    
+    message_dict = message.to_dict()
+    
+    # Deliver through WhatsApp and record analytics off the request path
+    outbound_queue.enqueue(message.id)
+    analytics_queue.enqueue(
+        company_id=chatbot.company_id,
+        event_name=AnalyticsEventTypes.MESSAGE_SENT,
+        chatbot_id=chatbot.id,
+        user_id=user_id,
+        event_data={
+            'conversation_id': conversation_id,
+            'message_type': message_dict['type'],
+            'customer_phone': conversation.customer_phone
         }
-        
-        message = conversation.add_message(message_data)
-        db.session.commit()
-        
-        # TODO: Send message via WhatsApp API
-        # send_whatsapp_message(chatbot, conversation.customer_phone, message_data)
-        
-        # Track analytics event
-        AnalyticsEvent.track_event(
-            company_id=chatbot.company_id,
-            event_name=AnalyticsEventTypes.MESSAGE_SENT,
-            chatbot_id=chatbot.id,
-            user_id=user_id,
-            event_data={
-                'conversation_id': conversation_id,
-                'message_type': message.type,
-                'customer_phone': conversation.customer_phone
-            }
-        )
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Message sent successfully',
-            'message_data': message.to_dict()
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Send message error: {str(e)}")
-        return jsonify({'error': 'Failed to send message'}), 500
+    )
+    
+    return jsonify({
+        'message': 'Message sent successfully',
+        'message_data': message_dict
+    }), 201
 
 @conversations_bp.route('/<conversation_id>/close', methods=['POST'])
 @jwt_required()
-def close_conversation(conversation_id):
+@require_conversation_access
+def close_conversation(conversation_id, conversation):
     """Close a conversation"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        # Check access
-        chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        # Close the conversation
-        conversation.close()
-        db.session.commit()
-        
-        # Track analytics event
-        AnalyticsEvent.track_event(
-            company_id=chatbot.company_id,
-            event_name=AnalyticsEventTypes.CONVERSATION_ENDED,
-            chatbot_id=chatbot.id,
-            user_id=user_id,
-            event_data={
-                'conversation_id': conversation_id,
-                'customer_phone': conversation.customer_phone,
-                'duration_minutes': conversation.get_duration_minutes()
-            }
-        )
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Conversation closed successfully',
-            'conversation': conversation.to_dict()
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Close conversation error: {str(e)}")
-        return jsonify({'error': 'Failed to close conversation'}), 500
+    user_id = get_jwt_identity()
+    chatbot = conversation.chatbot
+    
+    # Close the conversation
+    conversation.close()
+    result = _mutation_result(conversation, 'status', 'ended_at')
+    
+    # Track analytics event in the same transaction as the status change
+    AnalyticsEvent.track_event(
+        company_id=chatbot.company_id,
+        event_name=AnalyticsEventTypes.CONVERSATION_ENDED,
+        chatbot_id=chatbot.id,
+        user_id=user_id,
+        event_data={
+            'conversation_id': conversation_id,
+            'customer_phone': conversation.customer_phone,
+            'duration_minutes': conversation.get_duration_minutes()
+        }
+    )
+    db.session.commit()
+    conversation_cache.invalidate(conversation_id)
+    
+    return jsonify({
+        'message': 'Conversation closed successfully',
+        'conversation': result or conversation.to_dict()
+    }), 200
 
 @conversations_bp.route('/<conversation_id>/reopen', methods=['POST'])
 @jwt_required()
-def reopen_conversation(conversation_id):
+@require_conversation_access
+def reopen_conversation(conversation_id, conversation):
     """Reopen a closed conversation"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        # Check access
-        chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        # Reopen the conversation
-        conversation.reopen()
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Conversation reopened successfully',
-            'conversation': conversation.to_dict()
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Reopen conversation error: {str(e)}")
-        return jsonify({'error': 'Failed to reopen conversation'}), 500
+    # Reopen the conversation
+    conversation.reopen()
+    result = _mutation_result(conversation, 'status', 'ended_at')
+    db.session.commit()
+    conversation_cache.invalidate(conversation_id)
+    
+    return jsonify({
+        'message': 'Conversation reopened successfully',
+        'conversation': result or conversation.to_dict()
+    }), 200
 
 @conversations_bp.route('/<conversation_id>/assign', methods=['POST'])
 @jwt_required()
-def assign_conversation(conversation_id):
+@require_conversation_access
+def assign_conversation(conversation_id, conversation):
     """Assign conversation to a user"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        # Check access
-        chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        data = request.get_json()
-        assign_to_user_id = data.get('user_id')
-        
-        if assign_to_user_id:
-            # Verify the user exists and has access to this company
-            assign_to_user = User.find_by_id(assign_to_user_id)
-            if not assign_to_user:
-                return jsonify({'error': 'User to assign not found'}), 404
-            
-            assign_to_companies = [comp['company'].id for comp in assign_to_user.get_companies()]
-            if chatbot.company_id not in assign_to_companies:
-                return jsonify({'error': 'User does not have access to this company'}), 403
-        
-        # Assign the conversation
-        conversation.assign_to_user(assign_to_user_id)
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Conversation assigned successfully',
-            'conversation': conversation.to_dict()
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Assign conversation error: {str(e)}")
-        return jsonify({'error': 'Failed to assign conversation'}), 500
+    chatbot = conversation.chatbot
+    
+    data, error = _read_json_body()
+    if error:
+        return error
+    assign_to_user_id = data.get('user_id')
+    
+    # Verify the user exists and has access to this company in one query
+    if assign_to_user_id and not User.user_has_company_access(assign_to_user_id, chatbot.company_id):
+        return jsonify({'error': 'User to assign not found or has no access to this company'}), 403
+    
+    # Assign the conversation
+    conversation.assign_to_user(assign_to_user_id)
+    result = _mutation_result(conversation, 'assigned_to')
+    db.session.commit()
+    conversation_cache.invalidate(conversation_id)
+    
+    return jsonify({
+        'message': 'Conversation assigned successfully',
+        'conversation': result or conversation.to_dict()
+    }), 200
 
 @conversations_bp.route('/<conversation_id>/tags', methods=['POST'])
 @jwt_required()
-def add_conversation_tag(conversation_id):
+@require_conversation_access
+def add_conversation_tag(conversation_id, conversation):
     """Add a tag to a conversation"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        # Check access
-        chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        data = request.get_json()
-        tag = data.get('tag', '').strip()
-        
-        if not tag:
-            return jsonify({'error': 'Tag is required'}), 400
-        
-        # Add the tag
-        conversation.add_tag(tag)
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Tag added successfully',
-            'conversation': conversation.to_dict()
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Add conversation tag error: {str(e)}")
-        return jsonify({'error': 'Failed to add tag'}), 500
+    data, error = _read_json_body()
+    if error:
+        return error
+    tag = data.get('tag', '')
+    
+    # Reject oversized or non-string tags before doing any work with them
+    if not isinstance(tag, str) or len(tag) > MAX_TAG_LENGTH:
+        return jsonify({'error': f'Tag must be a string of at most {MAX_TAG_LENGTH} characters'}), 400
+    
+    tag = tag.strip()
+    if not tag:
+        return jsonify({'error': 'Tag is required'}), 400
+    
+    # Add the tag
+    conversation.add_tag(tag)
+    result = _mutation_result(conversation, 'tags')
+    db.session.commit()
+    conversation_cache.invalidate(conversation_id)
+    
+    return jsonify({
+        'message': 'Tag added successfully',
+        'conversation': result or conversation.to_dict()
+    }), 200
 
 @conversations_bp.route('/<conversation_id>/tags/<tag>', methods=['DELETE'])
 @jwt_required()
-def remove_conversation_tag(conversation_id, tag):
+@require_conversation_access
+def remove_conversation_tag(conversation_id, tag, conversation):
     """Remove a tag from a conversation"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        # Check access
-        chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        # Remove the tag
-        conversation.remove_tag(tag)
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Tag removed successfully',
-            'conversation': conversation.to_dict()
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Remove conversation tag error: {str(e)}")
-        return jsonify({'error': 'Failed to remove tag'}), 500
+    # Remove the tag
+    conversation.remove_tag(tag)
+    result = _mutation_result(conversation, 'tags')
+    db.session.commit()
+    conversation_cache.invalidate(conversation_id)
+    
+    return jsonify({
+        'message': 'Tag removed successfully',
+        'conversation': result or conversation.to_dict()
+    }), 200
 
 @conversations_bp.route('/<conversation_id>/metadata', methods=['PUT'])
 @jwt_required()
-def update_conversation_metadata(conversation_id):
+@require_conversation_access
+def update_conversation_metadata(conversation_id, conversation):
     """Update conversation metadata"""
-    try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        conversation = Conversation.query.get(conversation_id)
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        # Check access
-        chatbot = conversation.chatbot
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        data = request.get_json()
-        metadata = data.get('metadata', {})
-        
-        # Update metadata
-        conversation.update_metadata(metadata)
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Metadata updated successfully',
-            'conversation': conversation.to_dict()
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Update conversation metadata error: {str(e)}")
-        return jsonify({'error': 'Failed to update metadata'}), 500
+    data, error = _read_json_body()
+    if error:
+        return error
+    metadata = data.get('metadata', {})
+    
+    # Update metadata
+    conversation.update_metadata(metadata)
+    result = _mutation_result(conversation, 'conversation_metadata')
+    db.session.commit()
+    conversation_cache.invalidate(conversation_id)
+    
+    return jsonify({
+        'message': 'Metadata updated successfully',
+        'conversation': result or conversation.to_dict()
+    }), 200
 
@@ -3,86 +3,118 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 
 from src.models import db
-from src.models.user import User
 from src.models.chatbot import Chatbot
-from src.models.analytics import AnalyticsEvent, AnalyticsEventTypes
+from src.models.analytics import AnalyticsEventTypes
 from src.services.botpress_service import botpress_service
 from src.services.whatsapp_service import whatsapp_service
+from src.services.cache_service import cache_service
+from src.services.analytics_queue import analytics_queue
+from src.routes.access import current_user_active, require_chatbot_access
+from src.routes.rate_limit import rate_limit
 
 integrations_bp = Blueprint('integrations', __name__)
 
+# The Botpress bot list only backs the connection test, so a short-lived copy is enough
+BOTPRESS_BOTS_CACHE_KEY = 'botpress:bots:list'
+BOTPRESS_BOTS_CACHE_TTL = 60
+
+# Per-user cap on endpoints that trigger paid or slow upstream work; enforced before any DB access
+UPSTREAM_CALLS_PER_MINUTE = 60
+
+# Successful WhatsApp connection probes are reused briefly, so a repeatedly clicked test button stays cheap
+WHATSAPP_CONNECTION_CACHE_TTL = 30
+
+def _send_text(phone_number_id, to, data):
+    """Send a manual text message"""
+    return whatsapp_service.send_text_message(phone_number_id, to, data['content'])
+
+def _send_template(phone_number_id, to, data):
+    """Send a manual template message"""
+    return whatsapp_service.send_template_message(
+        phone_number_id,
+        to,
+        data['template_name'],
+        data.get('language_code', 'en'),
+        data.get('parameters', [])
+    )
+
+# Manual send handlers by message type: (extra required fields, sender)
+MESSAGE_SENDERS = {
+    'text': ((), _send_text),
+    'template': (('template_name',), _send_template),
+}
+
 @integrations_bp.route('/botpress/bots', methods=['POST'])
 @jwt_required()
-def create_botpress_bot():
+@require_chatbot_access(with_company=True)
+def create_botpress_bot(chatbot):
     """Create a new bot in Botpress"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        data = request.get_json()
-        chatbot_id = data.get('chatbot_id')
-        
-        if not chatbot_id:
-            return jsonify({'error': 'chatbot_id is required'}), 400
-        
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
+        if not current_user_active():
+            return jsonify({'error': 'User not found or inactive'}), 401
         
         # Create bot in Botpress
-        bot_name = f"{chatbot.name} - {chatbot.company.name}"
-        bot_description = chatbot.description or f"WhatsApp chatbot for {chatbot.company.name}"
+        company_name = chatbot.company.name
+        bot_name = f"{chatbot.name} - {company_name}"
+        bot_description = chatbot.description or f"WhatsApp chatbot for {company_name}"
+        
+        # Hand the connection back while Botpress works
+        db.session.close()
         
         botpress_bot = botpress_service.create_bot(
             name=bot_name,
             description=bot_description
         )
-        
-        # Update chatbot with Botpress bot ID
-        chatbot.botpress_bot_id = botpress_bot.get('bot', {}).get('id')
-        chatbot.updated_at = datetime.utcnow()
+        botpress_bot_id = botpress_bot.get('bot', {}).get('id')
         
         # Create webhook for the bot
-        webhook_url = f"{request.host_url}api/webhooks/botpress"
+        webhook_url = current_app.config['BOTPRESS_WEBHOOK_URL']
+        botpress_webhook_id = None
         try:
             webhook = botpress_service.create_webhook(
-                chatbot.botpress_bot_id,
+                botpress_bot_id,
                 webhook_url
             )
-            chatbot.botpress_webhook_id = webhook.get('webhook', {}).get('id')
+            botpress_webhook_id = webhook.get('webhook', {}).get('id')
         except Exception as e:
             current_app.logger.warning(f"Failed to create Botpress webhook: {str(e)}")
         
+        # Reload the chatbot on a fresh connection; it may have been deleted meanwhile
+        chatbot = Chatbot.find_by_id(chatbot.id)
+        if not chatbot:
+            return jsonify({'error': 'Chatbot not found'}), 404
+        
+        # Update chatbot with Botpress bot ID
+        chatbot.botpress_bot_id = botpress_bot_id
+        chatbot.botpress_webhook_id = botpress_webhook_id
+        chatbot.updated_at = datetime.utcnow()
         db.session.commit()
+        cache_service.delete(BOTPRESS_BOTS_CACHE_KEY)
+        
+        # Build the response, then hand the connection back before follow-up work
+        chatbot_data = chatbot.to_dict()
+        db.session.remove()
         
         # Track analytics event
-        AnalyticsEvent.track_event(
-            company_id=chatbot.company_id,
+        analytics_queue.enqueue(
+            company_id=chatbot_data['company_id'],
             event_name=AnalyticsEventTypes.INTEGRATION_CONNECTED,
-            chatbot_id=chatbot.id,
+            chatbot_id=chatbot_data['id'],
             user_id=user_id,
             event_data={
                 'integration_type': 'botpress',
-                'bot_id': chatbot.botpress_bot_id,
+                'bot_id': botpress_bot_id,
                 'bot_name': bot_name
             },
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent')
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Botpress bot created successfully',
             'bot': botpress_bot,
-            'chatbot': chatbot.to_dict()
+            'chatbot': chatbot_data
         }), 201
         
     except Exception as e:
@@ -92,31 +124,23 @@ def create_botpress_bot():
 
 @integrations_bp.route('/botpress/bots/<bot_id>', methods=['GET'])
 @jwt_required()
-def get_botpress_bot(bot_id):
+@require_chatbot_access(lookup_by='botpress_bot_id', arg='bot_id')
+def get_botpress_bot(bot_id, chatbot):
     """Get Botpress bot details"""
     try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
+        if not current_user_active():
+            return jsonify({'error': 'User not found or inactive'}), 401
         
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Find chatbot by Botpress bot ID
-        chatbot = Chatbot.query.filter_by(botpress_bot_id=bot_id).first()
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
+        # Hand the connection back before calling Botpress
+        chatbot_data = chatbot.to_dict()
+        db.session.close()
         
         # Get bot details from Botpress
         bot_details = botpress_service.get_bot(bot_id)
         
         return jsonify({
             'bot': bot_details,
-            'chatbot': chatbot.to_dict()
+            'chatbot': chatbot_data
         }), 200
         
     except Exception as e:
@@ -125,30 +149,23 @@ def get_botpress_bot(bot_id):
 
 @integrations_bp.route('/botpress/bots/<bot_id>/train', methods=['POST'])
 @jwt_required()
-def train_botpress_bot(bot_id):
+@rate_limit(UPSTREAM_CALLS_PER_MINUTE, key_arg='bot_id')
+@require_chatbot_access(lookup_by='botpress_bot_id', arg='bot_id')
+def train_botpress_bot(bot_id, chatbot):
     """Train Botpress bot"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
+        if not current_user_active():
+            return jsonify({'error': 'User not found or inactive'}), 401
         
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Find chatbot by Botpress bot ID
-        chatbot = Chatbot.query.filter_by(botpress_bot_id=bot_id).first()
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
+        # Hand the connection back before calling Botpress
+        db.session.close()
         
         # Train bot in Botpress
         training_result = botpress_service.train_bot(bot_id)
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=chatbot.company_id,
             event_name=AnalyticsEventTypes.BOT_TRAINED,
             chatbot_id=chatbot.id,
@@ -158,7 +175,6 @@ def train_botpress_bot(bot_id):
                 'training_result': training_result
             }
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Bot training started',
@@ -171,24 +187,15 @@ def train_botpress_bot(bot_id):
 
 @integrations_bp.route('/botpress/bots/<bot_id>/training-status', methods=['GET'])
 @jwt_required()
+@require_chatbot_access(lookup_by='botpress_bot_id', arg='bot_id', load=False)
 def get_botpress_training_status(bot_id):
     """Get Botpress bot training status"""
     try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Find chatbot by Botpress bot ID
-        chatbot = Chatbot.query.filter_by(botpress_bot_id=bot_id).first()
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
+        if not current_user_active():
+            return jsonify({'error': 'User not found or inactive'}), 401
         
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
+        # Hand the connection back before calling Botpress
+        db.session.close()
         
         # Get training status from Botpress
         training_status = botpress_service.get_training_status(bot_id)
@@ -203,24 +210,12 @@ def get_botpress_training_status(bot_id):
 
 @integrations_bp.route('/botpress/bots/<bot_id>/intents', methods=['POST'])
 @jwt_required()
+@require_chatbot_access(lookup_by='botpress_bot_id', arg='bot_id', load=False)
 def create_botpress_intent(bot_id):
     """Create intent for Botpress bot"""
     try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Find chatbot by Botpress bot ID
-        chatbot = Chatbot.query.filter_by(botpress_bot_id=bot_id).first()
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
+        if not current_user_active():
+            return jsonify({'error': 'User not found or inactive'}), 401
         
         data = request.get_json()
         
@@ -228,6 +223,9 @@ def create_botpress_intent(bot_id):
         if not data.get('name') or not data.get('utterances') or not data.get('responses'):
             return jsonify({'error': 'name, utterances, and responses are required'}), 400
         
+        # Hand the connection back before calling Botpress
+        db.session.close()
+        
         # Create intent in Botpress
         intent = botpress_service.create_intent(
             bot_id,
@@ -247,24 +245,15 @@ def create_botpress_intent(bot_id):
 
 @integrations_bp.route('/whatsapp/phone-numbers/<phone_number_id>/profile', methods=['GET'])
 @jwt_required()
+@require_chatbot_access(lookup_by='whatsapp_phone_number_id', arg='phone_number_id', load=False)
 def get_whatsapp_business_profile(phone_number_id):
     """Get WhatsApp business profile"""
     try:
-        user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
+        if not current_user_active():
+            return jsonify({'error': 'User not found or inactive'}), 401
         
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Find chatbot by phone number ID
-        chatbot = Chatbot.query.filter_by(whatsapp_phone_number_id=phone_number_id).first()
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
+        # Hand the connection back before calling WhatsApp
+        db.session.close()
         
         # Get business profile from WhatsApp
         profile = whatsapp_service.get_business_profile(phone_number_id)
@@ -279,32 +268,24 @@ def get_whatsapp_business_profile(phone_number_id):
 
 @integrations_bp.route('/whatsapp/phone-numbers/<phone_number_id>/profile', methods=['PUT'])
 @jwt_required()
-def update_whatsapp_business_profile(phone_number_id):
+@require_chatbot_access(lookup_by='whatsapp_phone_number_id', arg='phone_number_id')
+def update_whatsapp_business_profile(phone_number_id, chatbot):
     """Update WhatsApp business profile"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Find chatbot by phone number ID
-        chatbot = Chatbot.query.filter_by(whatsapp_phone_number_id=phone_number_id).first()
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
-        
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
+        if not current_user_active():
+            return jsonify({'error': 'User not found or inactive'}), 401
         
         data = request.get_json()
         
+        # Hand the connection back before calling WhatsApp
+        db.session.close()
+        
         # Update business profile in WhatsApp
         result = whatsapp_service.update_business_profile(phone_number_id, data)
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=chatbot.company_id,
             event_name=AnalyticsEventTypes.INTEGRATION_UPDATED,
             chatbot_id=chatbot.id,
@@ -315,7 +296,6 @@ def update_whatsapp_business_profile(phone_number_id):
                 'profile_data': data
             }
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Business profile updated successfully',
@@ -328,32 +308,30 @@ def update_whatsapp_business_profile(phone_number_id):
 
 @integrations_bp.route('/whatsapp/send-message', methods=['POST'])
 @jwt_required()
-def send_whatsapp_message():
+@rate_limit(UPSTREAM_CALLS_PER_MINUTE, key_arg='chatbot_id')
+@require_chatbot_access
+def send_whatsapp_message(chatbot):
     """Send WhatsApp message manually"""
     try:
         user_id = get_jwt_identity()
-        user = User.find_by_id(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+        if not current_user_active():
+            return jsonify({'error': 'User not found or inactive'}), 401
         
         data = request.get_json()
-        chatbot_id = data.get('chatbot_id')
         to = data.get('to')
         message_type = data.get('type', 'text')
         content = data.get('content')
         
-        if not all([chatbot_id, to, content]):
+        if not all([to, content]):
             return jsonify({'error': 'chatbot_id, to, and content are required'}), 400
         
-        chatbot = Chatbot.find_by_id(chatbot_id)
-        if not chatbot:
-            return jsonify({'error': 'Chatbot not found'}), 404
+        if message_type not in MESSAGE_SENDERS:
+            return jsonify({'error': 'Unsupported message type'}), 400
         
-        # Check access
-        user_companies = [comp['company'].id for comp in user.get_companies()]
-        if chatbot.company_id not in user_companies:
-            return jsonify({'error': 'Access denied'}), 403
+        required_fields, send = MESSAGE_SENDERS[message_type]
+        for field in required_fields:
+            if not data.get(field):
+                return jsonify({'error': f'{field} is required for {message_type} messages'}), 400
         
         if not chatbot.whatsapp_phone_number_id:
             return jsonify({'error': 'WhatsApp not configured for this chatbot'}), 400
@@ -363,33 +341,13 @@ def send_whatsapp_message():
         if not whatsapp_service.validate_phone_number(formatted_phone):
             return jsonify({'error': 'Invalid phone number format'}), 400
         
-        # Send message based on type
-        if message_type == 'text':
-            result = whatsapp_service.send_text_message(
-                chatbot.whatsapp_phone_number_id,
-                formatted_phone,
-                content
-            )
-        elif message_type == 'template':
-            template_name = data.get('template_name')
-            language_code = data.get('language_code', 'en')
-            parameters = data.get('parameters', [])
-            
-            if not template_name:
-                return jsonify({'error': 'template_name is required for template messages'}), 400
-            
-            result = whatsapp_service.send_template_message(
-                chatbot.whatsapp_phone_number_id,
-                formatted_phone,
-                template_name,
-                language_code,
-                parameters
-            )
-        else:
-            return jsonify({'error': 'Unsupported message type'}), 400
+        # Hand the connection back before calling WhatsApp
+        db.session.close()
+        
+        result = send(chatbot.whatsapp_phone_number_id, formatted_phone, data)
         
         # Track analytics event
-        AnalyticsEvent.track_event(
+        analytics_queue.enqueue(
             company_id=chatbot.company_id,
             event_name=AnalyticsEventTypes.MESSAGE_SENT,
             chatbot_id=chatbot.id,
@@ -400,7 +358,6 @@ def send_whatsapp_message():
                 'manual_send': True
             }
         )
-        db.session.commit()
         
         return jsonify({
             'message': 'Message sent successfully',
@@ -413,6 +370,7 @@ def send_whatsapp_message():
 
 @integrations_bp.route('/test-connection', methods=['POST'])
 @jwt_required()
+@rate_limit(UPSTREAM_CALLS_PER_MINUTE, key_arg='service')
 def test_integration_connection():
     """Test connection to external services"""
     try:
@@ -422,7 +380,11 @@ def test_integration_connection():
         if service == 'botpress':
             # Test Botpress connection
             try:
-                bots = botpress_service.list_bots()
+                bots = cache_service.get_or_set(
+                    BOTPRESS_BOTS_CACHE_KEY,
+                    botpress_service.list_bots,
+                    ttl=BOTPRESS_BOTS_CACHE_TTL
+                )
                 return jsonify({
                     'service': 'botpress',
                     'status': 'connected',
@@ -443,7 +405,11 @@ def test_integration_connection():
                 return jsonify({'error': 'phone_number_id is required for WhatsApp test'}), 400
             
             try:
-                phone_info = whatsapp_service.get_phone_number_info(phone_number_id)
+                phone_info = cache_service.get_or_set(
+                    f'conn_test:whatsapp:{phone_number_id}',
+                    lambda: whatsapp_service.get_phone_number_info(phone_number_id),
+                    ttl=WHATSAPP_CONNECTION_CACHE_TTL
+                )
                 return jsonify({
                     'service': 'whatsapp',
                     'status': 'connected',
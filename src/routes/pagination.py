@@ -0,0 +1,32 @@
+import base64
+from datetime import datetime
+
+from sqlalchemy import or_, and_
+
+def encode_cursor(timestamp, row_id):
+    """Encode a (timestamp, id) keyset position as an opaque URL-safe cursor"""
+    value = f"{timestamp.isoformat() if timestamp else ''}|{row_id}"
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor; raises ValueError if it is malformed"""
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, row_id = value.split('|', 1)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+    return (datetime.fromisoformat(timestamp) if timestamp else None), row_id
+
+def keyset_before(timestamp_column, id_column, cursor):
+    """Filter for rows after `cursor` when ordered by timestamp DESC NULLS LAST, id DESC"""
+    timestamp, row_id = decode_cursor(cursor)
+
+    if timestamp is None:
+        return and_(timestamp_column.is_(None), id_column < row_id)
+
+    return or_(
+        timestamp_column < timestamp,
+        and_(timestamp_column == timestamp, id_column < row_id),
+        timestamp_column.is_(None)
+    )
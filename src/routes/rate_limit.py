@@ -0,0 +1,30 @@
+from functools import wraps
+
+from flask import jsonify, request
+from flask_jwt_extended import get_jwt_identity
+
+from src.services.rate_limiter import rate_limiter
+
+def rate_limit(limit, period=60, key_arg=None):
+    """Limit each user to `limit` calls per `period` seconds on the decorated view
+
+    `key_arg` names a URL argument or JSON body field to count separately (e.g. per chatbot).
+    Apply after @jwt_required() and before any decorator that queries the database.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = f'{request.endpoint}:{get_jwt_identity()}'
+            if key_arg:
+                value = kwargs[key_arg] if key_arg in kwargs else (request.get_json(silent=True) or {}).get(key_arg)
+                key = f'{key}:{value or "-"}'
+
+            retry_after = rate_limiter.hit(key, limit, period)
+            if retry_after is not None:
+                response = jsonify({'error': 'Too many requests, please try again later'})
+                response.headers['Retry-After'] = str(retry_after)
+                return response, 429
+
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,27 @@
+_TYPE_NAMES = {str: 'a string', bool: 'a boolean', int: 'an integer', dict: 'an object', list: 'a list'}
+
+def validate_payload(data, fields, required=()):
+    """Check a JSON body against a {field: type} schema in one pass; returns (payload, error)"""
+    if not isinstance(data, dict):
+        return None, 'Request body must be a JSON object'
+
+    for field in required:
+        if not data.get(field):
+            return None, f'{field} is required'
+
+    payload = {}
+    for field, value in data.items():
+        expected = fields.get(field)
+        if expected is None:
+            # Unknown fields are ignored, as the per-field lookups did before
+            continue
+
+        # bool is a subclass of int, so reject it explicitly for integer fields
+        if value is not None and (
+            not isinstance(value, expected) or (expected is int and isinstance(value, bool))
+        ):
+            return None, f'{field} must be {_TYPE_NAMES.get(expected, expected.__name__)}'
+
+        payload[field] = value
+
+    return payload, None
@@ -0,0 +1,136 @@
+import os
+import uuid
+from typing import Dict, List
+from datetime import datetime
+import logging
+import time
+
+import orjson
+import redis
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from src.models import db
+from src.models.analytics import AnalyticsEvent
+
+logger = logging.getLogger(__name__)
+
+# Database outages: the batch goes back on the queue instead of being dead-lettered
+TRANSIENT_DB_ERRORS = (OperationalError, InterfaceError)
+
+class AnalyticsQueue:
+    """Buffers analytics events in Redis so a worker can batch-insert them"""
+
+    QUEUE_KEY = 'analytics:events'
+    DEAD_LETTER_KEY = 'analytics:events:dead'
+
+    def __init__(self):
+        self.redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(
+            self.redis_url,
+            socket_connect_timeout=1,
+            socket_timeout=5
+        )
+        self.columns = set(AnalyticsEvent.__table__.columns.keys())
+
+    def enqueue(self, company_id: str, event_name: str, **kwargs) -> bool:
+        """Queue an analytics event; falls back to an inline insert if Redis is down"""
+        payload = {
+            'id': str(uuid.uuid4()),
+            'company_id': company_id,
+            'event_name': event_name,
+            'created_at': datetime.utcnow().isoformat(),
+            **kwargs
+        }
+
+        try:
+            self.client.lpush(self.QUEUE_KEY, orjson.dumps(payload))
+            return True
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Analytics queue unavailable, writing event inline: {str(e)}")
+            AnalyticsEvent.track_event(company_id=company_id, event_name=event_name, **kwargs)
+            db.session.commit()
+            return False
+
+    def _to_row(self, raw: bytes) -> Dict:
+        """Decode a queued payload into an AnalyticsEvent column mapping"""
+        data = orjson.loads(raw)
+        row = {key: value for key, value in data.items() if key in self.columns}
+        row['created_at'] = datetime.fromisoformat(row['created_at'])
+        return row
+
+    def drain(self, batch_size: int = 500, timeout: int = 1) -> int:
+        """Pop up to batch_size events and insert them in a single transaction"""
+        first = self.client.brpop(self.QUEUE_KEY, timeout=timeout)
+        if not first:
+            return 0
+
+        raw_events: List[bytes] = [first[1]]
+        if batch_size > 1:
+            raw_events.extend(self.client.rpop(self.QUEUE_KEY, batch_size - 1) or [])
+
+        try:
+            self._insert(raw_events)
+        except TRANSIENT_DB_ERRORS:
+            db.session.rollback()
+            self._push_back(raw_events)
+            raise
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Analytics batch of {len(raw_events)} failed, inserting events one by one: {str(e)}")
+            return self._insert_each(raw_events)
+
+        logger.info(f"Inserted {len(raw_events)} analytics events")
+        return len(raw_events)
+
+    def _insert(self, raw_events: List[bytes]):
+        """Insert decoded events in a single transaction"""
+        rows = [self._to_row(raw) for raw in raw_events]
+        db.session.bulk_insert_mappings(AnalyticsEvent, rows)
+        db.session.commit()
+
+    def _insert_each(self, raw_events: List[bytes]) -> int:
+        """Insert events one at a time so a bad event is dead-lettered without losing the rest"""
+        inserted = 0
+        for index, raw in enumerate(raw_events):
+            try:
+                self._insert([raw])
+                inserted += 1
+            except TRANSIENT_DB_ERRORS:
+                db.session.rollback()
+                self._push_back(raw_events[index:])
+                raise
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Dead-lettering analytics event: {str(e)}")
+                self._dead_letter(raw)
+        return inserted
+
+    def _push_back(self, raw_events: List[bytes]):
+        """Return popped events to the consuming end of the queue, oldest first"""
+        try:
+            self.client.rpush(self.QUEUE_KEY, *reversed(raw_events))
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Lost {len(raw_events)} analytics events, could not requeue them: {str(e)}")
+
+    def _dead_letter(self, raw: bytes):
+        """Park an event that cannot be inserted for inspection"""
+        try:
+            self.client.lpush(self.DEAD_LETTER_KEY, raw)
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Lost analytics event, could not dead-letter it: {str(e)}")
+
+    def run_worker(self, app, batch_size: int = 500, timeout: int = 1):
+        """Block forever, flushing queued events every `timeout` seconds or `batch_size` events"""
+        with app.app_context():
+            logger.info("Analytics worker started")
+            while True:
+                try:
+                    self.drain(batch_size=batch_size, timeout=timeout)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Failed to flush analytics events: {str(e)}")
+                    # Requeued events would otherwise be retried in a tight loop
+                    time.sleep(timeout)
+
+# Global instance
+analytics_queue = AnalyticsQueue()
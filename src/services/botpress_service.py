@@ -1,5 +1,9 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import hmac
+import hashlib
 import os
 from typing import Dict, List, Optional, Any
 from datetime import datetime
@@ -10,6 +14,9 @@ logger = logging.getLogger(__name__)
 class BotpressService:
     """Service for integrating with Botpress Cloud API"""
     
+    POOL_CONNECTIONS = 20
+    POOL_MAXSIZE = 50
+    
     def __init__(self):
         self.api_url = os.environ.get('BOTPRESS_API_URL', 'https://api.botpress.cloud')
         self.api_token = os.environ.get('BOTPRESS_API_TOKEN')
@@ -23,6 +30,19 @@ class BotpressService:
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
+        
+        # One pooled session per service keeps TCP/TLS connections alive between calls.
+        # Failed connects are retried; read errors and gateway errors only for idempotent
+        # methods, so no POST is sent twice
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=self.POOL_CONNECTIONS,
+            pool_maxsize=self.POOL_MAXSIZE,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), raise_on_status=False)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
     
     def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict:
         """Make HTTP request to Botpress API"""
@@ -30,13 +50,13 @@ class BotpressService:
         
         try:
             if method.upper() == 'GET':
-                response = requests.get(url, headers=self.headers, params=data)
+                response = self.session.get(url, params=data)
             elif method.upper() == 'POST':
-                response = requests.post(url, headers=self.headers, json=data)
+                response = self.session.post(url, json=data)
             elif method.upper() == 'PUT':
-                response = requests.put(url, headers=self.headers, json=data)
+                response = self.session.put(url, json=data)
             elif method.upper() == 'DELETE':
-                response = requests.delete(url, headers=self.headers)
+                response = self.session.delete(url)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
             
@@ -265,16 +285,9 @@ class BotpressService:
             logger.error(f"Failed to deploy bot: {str(e)}")
             raise
     
-    def validate_webhook_signature(self, payload: str, signature: str, secret: str) -> bool:
+    def validate_webhook_signature(self, payload: bytes, signature: str, secret: str) -> bool:
         """Validate webhook signature for security"""
-        import hmac
-        import hashlib
-        
-        expected_signature = hmac.new(
-            secret.encode('utf-8'),
-            payload.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        expected_signature = hmac.new(secret.encode('utf-8'), payload, hashlib.sha256).hexdigest()
         
         return hmac.compare_digest(signature, f"sha256={expected_signature}")
     
@@ -0,0 +1,69 @@
+import os
+from typing import Any, Callable, Optional
+import logging
+
+import orjson
+import redis
+
+logger = logging.getLogger(__name__)
+
+class CacheService:
+    """Short-lived JSON cache in Redis; every failure degrades to a cache miss"""
+
+    def __init__(self):
+        self.redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(
+            self.redis_url,
+            socket_connect_timeout=1,
+            socket_timeout=1
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a cached value, or None on a miss or if Redis is unavailable"""
+        try:
+            raw = self.client.get(key)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Cache get failed for {key}: {str(e)}")
+            return None
+
+        return orjson.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: int = 60) -> bool:
+        """Cache a JSON-serializable value for `ttl` seconds"""
+        try:
+            self.client.set(key, orjson.dumps(value), ex=ttl)
+            return True
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Cache set failed for {key}: {str(e)}")
+            return False
+
+    def get_or_set(self, key: str, loader: Callable[[], Any], ttl: int = 60) -> Any:
+        """Get a cached value, calling `loader` and caching its result on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def delete(self, *keys: str) -> bool:
+        """Remove cached values"""
+        try:
+            self.client.delete(*keys)
+            return True
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Cache delete failed for {keys}: {str(e)}")
+            return False
+
+    def delete_prefix(self, prefix: str) -> bool:
+        """Remove every cached value whose key starts with `prefix`"""
+        try:
+            keys = list(self.client.scan_iter(match=f'{prefix}*', count=100))
+            if keys:
+                self.client.delete(*keys)
+            return True
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Cache delete failed for {prefix}*: {str(e)}")
+            return False
+
+# Global instance
+cache_service = CacheService()
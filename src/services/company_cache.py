@@ -0,0 +1,31 @@
+import hashlib
+from typing import Dict, Optional
+
+import orjson
+
+from src.services.cache_service import cache_service
+
+class CompanyCache:
+    """Caches the get_company payload (company, team, usage) per company with an ETag"""
+
+    TTL = 300
+
+    def _key(self, company_id: str) -> str:
+        return f'company:dict:{company_id}'
+
+    def get(self, company_id: str) -> Optional[Dict]:
+        """Get the cached {'etag', 'company'} entry, or None on a miss"""
+        return cache_service.get(self._key(company_id))
+
+    def set(self, company_id: str, company_data: Dict) -> str:
+        """Cache a company payload and return its ETag"""
+        etag = hashlib.sha1(orjson.dumps(company_data, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        cache_service.set(self._key(company_id), {'etag': etag, 'company': company_data}, ttl=self.TTL)
+        return etag
+
+    def invalidate(self, company_id: str):
+        """Drop the cached payload after the company, its team or its chatbots change"""
+        cache_service.delete(self._key(company_id))
+
+# Global instance
+company_cache = CompanyCache()
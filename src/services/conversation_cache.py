@@ -0,0 +1,26 @@
+from typing import Dict, Optional
+
+from src.services.cache_service import cache_service
+
+class ConversationCache:
+    """Caches a conversation's header (its to_dict() plus chatbot summary), without messages"""
+
+    TTL = 60
+
+    def _key(self, conversation_id: str) -> str:
+        return f'conversation:dict:{conversation_id}'
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        """Get the cached conversation header, or None on a miss"""
+        return cache_service.get(self._key(conversation_id))
+
+    def set(self, conversation_id: str, conversation_data: Dict):
+        """Cache a conversation header"""
+        cache_service.set(self._key(conversation_id), conversation_data, ttl=self.TTL)
+
+    def invalidate(self, conversation_id: str):
+        """Drop the cached header after the conversation changes"""
+        cache_service.delete(self._key(conversation_id))
+
+# Global instance
+conversation_cache = ConversationCache()
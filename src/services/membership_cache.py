@@ -0,0 +1,76 @@
+from typing import Dict, Optional
+import logging
+
+from src.models import db
+from src.models.company import Company
+from src.models.user import CompanyUser
+from src.services.cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+class MembershipCache:
+    """Caches a user's role and permissions in a company, keyed by (company_id, user_id)"""
+
+    TTL = 300
+
+    def _key(self, company_id: str, user_id: str) -> str:
+        # Company first so a whole company can be invalidated by prefix
+        return f'membership:{company_id}:{user_id}'
+
+    def _load(self, user_id: str, company_id: str):
+        """Load ownership and membership with one query; False if the user has no access"""
+        row = db.session.query(
+            Company.owner_id,
+            CompanyUser.role,
+            CompanyUser.permissions
+        ).outerjoin(
+            CompanyUser,
+            (CompanyUser.company_id == Company.id) & (CompanyUser.user_id == user_id)
+        ).filter(
+            Company.id == company_id,
+            Company.deleted_at.is_(None)
+        ).first()
+
+        if not row:
+            return False
+
+        if row.owner_id == user_id:
+            return {'role': 'owner', 'permissions': {}, 'is_owner': True}
+
+        if row.role:
+            return {'role': row.role, 'permissions': row.permissions or {}, 'is_owner': False}
+
+        return False
+
+    def get(self, user_id: str, company_id: str) -> Optional[Dict]:
+        """Get the user's membership in a company, or None if they have no access"""
+        key = self._key(company_id, user_id)
+        membership = cache_service.get(key)
+
+        if membership is None:
+            membership = self._load(user_id, company_id)
+            # No-access results are cached too; invites invalidate them
+            cache_service.set(key, membership, ttl=self.TTL)
+
+        return membership or None
+
+    def has_permission(self, user, company_id: str, permission: str) -> bool:
+        """Check a company permission; admins and owners have every permission"""
+        if user.role == 'admin':
+            return True
+
+        membership = self.get(user.id, company_id)
+        if not membership:
+            return False
+
+        return membership['is_owner'] or bool(membership['permissions'].get(permission, False))
+
+    def invalidate(self, company_id: str, user_id: Optional[str] = None):
+        """Drop cached memberships for one user, or for the whole company"""
+        if user_id:
+            cache_service.delete(self._key(company_id, user_id))
+        else:
+            cache_service.delete_prefix(self._key(company_id, ''))
+
+# Global instance
+membership_cache = MembershipCache()
@@ -0,0 +1,100 @@
+import os
+import logging
+
+import redis
+
+from src.models import db
+from src.models.chatbot import Chatbot
+from src.models.conversation import Conversation, Message
+from src.services.conversation_cache import conversation_cache
+from src.services.whatsapp_service import whatsapp_service
+
+logger = logging.getLogger(__name__)
+
+MEDIA_MESSAGE_TYPES = ('image', 'audio', 'video', 'document')
+
+class OutboundMessageQueue:
+    """Queues outbound messages in Redis so a worker delivers them to WhatsApp off the request path"""
+
+    QUEUE_KEY = 'outbound:messages'
+
+    def __init__(self):
+        self.redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(
+            self.redis_url,
+            socket_connect_timeout=1,
+            socket_timeout=5
+        )
+
+    def enqueue(self, message_id: str) -> bool:
+        """Queue a committed message for delivery; falls back to sending inline if Redis is down"""
+        try:
+            self.client.lpush(self.QUEUE_KEY, message_id)
+            return True
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Outbound queue unavailable, sending message inline: {str(e)}")
+            self.deliver(message_id)
+            return False
+
+    def deliver(self, message_id: str):
+        """Send a stored message through the WhatsApp API and record the outcome on the message"""
+        message = db.session.get(Message, message_id)
+        if not message:
+            logger.warning(f"Outbound message {message_id} no longer exists")
+            return
+
+        conversation = message.conversation
+        # By key rather than conversation.chatbot: inline deliveries can get a conversation loaded with raiseload
+        phone_number_id = db.session.get(Chatbot, conversation.chatbot_id).whatsapp_phone_number_id
+
+        try:
+            if not phone_number_id:
+                raise Exception('WhatsApp is not configured for this chatbot')
+
+            if message.type == 'text':
+                result = whatsapp_service.send_text_message(
+                    phone_number_id, conversation.customer_phone, message.content
+                )
+            elif message.type in MEDIA_MESSAGE_TYPES:
+                result = whatsapp_service.send_media_message(
+                    phone_number_id, conversation.customer_phone,
+                    message.type, message.media_url, caption=message.content
+                )
+            else:
+                raise Exception(f"Unsupported outbound message type: {message.type}")
+
+            sent = result.get('messages') or [{}]
+            message.whatsapp_message_id = sent[0].get('id')
+        except Exception as e:
+            logger.error(f"Failed to deliver message {message_id}: {str(e)}")
+            message.mark_failed(str(e))
+
+        conversation_id = message.conversation_id
+        Conversation.touch(conversation_id)
+        db.session.commit()
+        conversation_cache.invalidate(conversation_id)
+
+    def drain(self, timeout: int = 1) -> int:
+        """Pop one queued message and deliver it"""
+        item = self.client.brpop(self.QUEUE_KEY, timeout=timeout)
+        if not item:
+            return 0
+
+        self.deliver(item[1].decode('utf-8'))
+        return 1
+
+    def run_worker(self, app, timeout: int = 1):
+        """Block forever, delivering queued messages as they arrive"""
+        with app.app_context():
+            logger.info("Outbound message worker started")
+            while True:
+                try:
+                    self.drain(timeout=timeout)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Failed to deliver outbound message: {str(e)}")
+                finally:
+                    db.session.remove()
+
+# Global instance
+outbound_queue = OutboundMessageQueue()
@@ -0,0 +1,40 @@
+import os
+import time
+from typing import Optional
+import logging
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Fixed-window request counters in Redis; fails open if Redis is unavailable"""
+
+    def __init__(self):
+        self.redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(
+            self.redis_url,
+            socket_connect_timeout=1,
+            socket_timeout=1
+        )
+
+    def hit(self, key: str, limit: int, period: int) -> Optional[int]:
+        """Count a request against `key`; returns seconds until the window resets if over `limit`, else None"""
+        window = int(time.time()) // period
+        window_key = f'ratelimit:{key}:{window}'
+
+        try:
+            pipe = self.client.pipeline()
+            pipe.incr(window_key)
+            pipe.expire(window_key, period)
+            count = pipe.execute()[0]
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Rate limiter unavailable, allowing request: {str(e)}")
+            return None
+
+        if count > limit:
+            return period - int(time.time()) % period
+        return None
+
+# Global instance
+rate_limiter = RateLimiter()
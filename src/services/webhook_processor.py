@@ -0,0 +1,286 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+import json
+import logging
+
+from sqlalchemy.orm import raiseload
+
+from src.models import db
+from src.models.chatbot import Chatbot
+from src.models.conversation import Conversation, Message
+from src.models.analytics import AnalyticsEvent, AnalyticsEventTypes
+from src.services.botpress_service import botpress_service
+from src.services.outbound_queue import outbound_queue
+from src.services.whatsapp_service import whatsapp_service
+
+logger = logging.getLogger(__name__)
+
+# Read receipts don't depend on the Botpress forward, so they are sent alongside it
+read_receipt_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='read-receipt')
+
+# Lookups here use raiseload('*'): processors only read columns, so any lazy
+# relationship load is a per-event N+1 and should fail loudly instead
+
+def send_whatsapp_message_followups(phone_number_id, message_id, botpress_bot_id, customer_phone, text):
+    """Mark an inbound WhatsApp message as read and forward it to Botpress, if the chatbot auto-responds"""
+    # Mark WhatsApp message as read while the message is forwarded
+    read_receipt = read_receipt_executor.submit(
+        whatsapp_service.mark_message_as_read, phone_number_id, message_id
+    )
+    
+    # Forward message to Botpress if configured
+    if botpress_bot_id:
+        try:
+            # Create or get Botpress conversation
+            botpress_conversation = botpress_service.create_conversation(
+                botpress_bot_id,
+                customer_phone,
+                'whatsapp'
+            )
+            
+            # Send message to Botpress
+            botpress_message = {
+                'type': 'text',
+                'text': text,
+                'userId': customer_phone
+            }
+            
+            botpress_service.send_message(
+                botpress_bot_id,
+                botpress_conversation.get('conversation', {}).get('id'),
+                botpress_message
+            )
+            
+        except Exception as e:
+            logger.error(f"Failed to forward message to Botpress: {str(e)}")
+    
+    try:
+        read_receipt.result()
+    except Exception as e:
+        logger.error(f"Failed to mark message as read: {str(e)}")
+
+def process_whatsapp_message(event, webhook_event_id):
+    """Process incoming WhatsApp message"""
+    try:
+        phone_number_id = event.get('phone_number_id')
+        customer_phone = event.get('from')
+        message_content = event.get('content', {})
+        message_type = event.get('message_type', 'text')
+        
+        # Find chatbot by phone number
+        chatbot = Chatbot.query.filter_by(
+            whatsapp_phone_number_id=phone_number_id,
+            status='active'
+        ).options(raiseload('*')).first()
+        
+        if not chatbot:
+            logger.warning(f"No active chatbot found for phone number ID: {phone_number_id}")
+            return
+        
+        # Find or create conversation
+        conversation = Conversation.query.filter_by(
+            chatbot_id=chatbot.id,
+            customer_phone=customer_phone,
+            status='open'
+        ).options(raiseload('*')).first()
+        
+        if not conversation:
+            conversation = Conversation(
+                chatbot_id=chatbot.id,
+                customer_phone=customer_phone,
+                customer_name=customer_phone,  # Will be updated if available
+                status='open',
+                started_at=datetime.utcnow(),
+                last_message_at=datetime.utcnow()
+            )
+            db.session.add(conversation)
+            db.session.flush()  # Get conversation ID
+            
+            # Track conversation started event
+            AnalyticsEvent.track_event(
+                company_id=chatbot.company_id,
+                event_name=AnalyticsEventTypes.CONVERSATION_STARTED,
+                chatbot_id=chatbot.id,
+                event_data={
+                    'conversation_id': conversation.id,
+                    'customer_phone': customer_phone,
+                    'channel': 'whatsapp'
+                }
+            )
+        
+        # Create message record
+        message_data = {
+            'direction': 'inbound',
+            'type': message_type,
+            'content': message_content.get('text', '') if message_type == 'text' else json.dumps(message_content),
+            'sender_phone': customer_phone,
+            'sender_name': customer_phone,
+            'whatsapp_message_id': event.get('message_id'),
+            'media_url': message_content.get('media_id') if message_type != 'text' else None,
+            'media_type': message_content.get('mime_type') if message_type != 'text' else None,
+            'message_metadata': {
+                'webhook_event_id': webhook_event_id,
+                'phone_number_id': phone_number_id,
+                'raw_event': event
+            }
+        }
+        
+        message = conversation.add_message(message_data)
+        db.session.flush()  # Get message ID
+        
+        # Track message received event
+        AnalyticsEvent.track_event(
+            company_id=chatbot.company_id,
+            event_name=AnalyticsEventTypes.MESSAGE_RECEIVED,
+            chatbot_id=chatbot.id,
+            event_data={
+                'conversation_id': conversation.id,
+                'message_id': message.id,
+                'message_type': message_type,
+                'customer_phone': customer_phone
+            }
+        )
+        
+        # Read receipt and Botpress forward are sent once this event is committed
+        send = partial(
+            send_whatsapp_message_followups,
+            phone_number_id,
+            event.get('message_id'),
+            chatbot.botpress_bot_id if chatbot.auto_response_enabled else None,
+            customer_phone,
+            message_content.get('text', '') if message_type == 'text' else f"[{message_type.upper()}] message received"
+        )
+        
+        logger.info(f"Processed WhatsApp message for conversation {conversation.id}")
+        return conversation.id, send
+        
+    except Exception as e:
+        logger.error(f"Failed to process WhatsApp message: {str(e)}")
+        raise
+
+def process_whatsapp_status(event, webhook_event_id):
+    """Process WhatsApp message status update"""
+    try:
+        message_id = event.get('message_id')
+        status = event.get('status')
+        
+        # Find message by WhatsApp message ID
+        message = Message.query.filter_by(whatsapp_message_id=message_id).first()
+        
+        if message:
+            # Update message status
+            if status == 'sent':
+                message.mark_delivered()
+            elif status == 'delivered':
+                message.mark_delivered()
+            elif status == 'read':
+                message.mark_read()
+            elif status == 'failed':
+                message.mark_failed(event.get('error', {}).get('message', 'Unknown error'))
+            
+            Conversation.touch(message.conversation_id)
+            logger.info(f"Updated message {message_id} status to {status}")
+            return message.conversation_id, None
+        
+    except Exception as e:
+        logger.error(f"Failed to process WhatsApp status: {str(e)}")
+        raise
+
+def process_botpress_message(event, webhook_event_id):
+    """Process incoming Botpress message (bot response)"""
+    try:
+        bot_id = event.get('bot_id')
+        conversation_id = event.get('conversation_id')
+        message_data = event.get('data', {})
+        
+        # Find chatbot by Botpress bot ID
+        chatbot = Chatbot.query.filter_by(
+            botpress_bot_id=bot_id,
+            status='active'
+        ).options(raiseload('*')).first()
+        
+        if not chatbot:
+            logger.warning(f"No active chatbot found for Botpress bot ID: {bot_id}")
+            return
+        
+        # Extract message content
+        message_text = message_data.get('payload', {}).get('text', '')
+        user_id = message_data.get('userId', '')
+        
+        if not message_text or not user_id:
+            logger.warning("Invalid Botpress message data")
+            return
+        
+        # Find conversation by customer phone
+        conversation = Conversation.query.filter_by(
+            chatbot_id=chatbot.id,
+            customer_phone=user_id,
+            status='open'
+        ).options(raiseload('*')).first()
+        
+        if not conversation:
+            logger.warning(f"No open conversation found for customer {user_id}")
+            return
+        
+        if not chatbot.whatsapp_phone_number_id:
+            logger.warning(f"WhatsApp is not configured for chatbot {chatbot.id}")
+            return
+        
+        # Record the response; the outbound queue sends it to WhatsApp once this event is committed
+        message_record_data = {
+            'direction': 'outbound',
+            'type': 'text',
+            'content': message_text,
+            'sender_phone': chatbot.whatsapp_phone_number,
+            'sender_name': chatbot.name,
+            'message_metadata': {
+                'webhook_event_id': webhook_event_id,
+                'botpress_conversation_id': conversation_id,
+                'bot_response': True
+            }
+        }
+        
+        message = conversation.add_message(message_record_data)
+        db.session.flush()  # Get message ID
+        
+        # Track message sent event
+        AnalyticsEvent.track_event(
+            company_id=chatbot.company_id,
+            event_name=AnalyticsEventTypes.MESSAGE_SENT,
+            chatbot_id=chatbot.id,
+            event_data={
+                'conversation_id': conversation.id,
+                'message_id': message.id,
+                'message_type': 'text',
+                'customer_phone': user_id,
+                'bot_response': True
+            }
+        )
+        
+        logger.info(f"Queued Botpress response to WhatsApp for conversation {conversation.id}")
+        return conversation.id, partial(outbound_queue.enqueue, message.id)
+        
+    except Exception as e:
+        logger.error(f"Failed to process Botpress message: {str(e)}")
+        raise
+
+def process_botpress_conversation_started(event, webhook_event_id):
+    """Process Botpress conversation started event"""
+    logger.info("Processed Botpress conversation started event")
+
+def process_botpress_conversation_ended(event, webhook_event_id):
+    """Process Botpress conversation ended event"""
+    logger.info("Processed Botpress conversation ended event")
+
+# Processors by (source, event type); each takes the stored event payload and the WebhookEvent ID.
+# They only do database work and return (conversation_id, send), or None: the conversation they
+# changed and a callable making the outbound calls. Sends are not idempotent, so they run only
+# after the event is committed as processed and a retry never replays them.
+EVENT_PROCESSORS = {
+    ('whatsapp', 'message_received'): process_whatsapp_message,
+    ('whatsapp', 'message_status'): process_whatsapp_status,
+    ('botpress', 'message_received'): process_botpress_message,
+    ('botpress', 'conversation_started'): process_botpress_conversation_started,
+    ('botpress', 'conversation_ended'): process_botpress_conversation_ended,
+}
@@ -0,0 +1,126 @@
+import os
+import logging
+import time
+
+import redis
+
+from src.models import db
+from src.models.webhook import WebhookEvent
+from src.services.conversation_cache import conversation_cache
+from src.services.webhook_processor import EVENT_PROCESSORS
+
+logger = logging.getLogger(__name__)
+
+class WebhookQueue:
+    """Queues stored webhook events in Redis so a worker processes them off the request path"""
+
+    QUEUE_KEY = 'webhooks:events'
+    # Failed events wait here, scored by when they are due, so retries back off
+    RETRY_KEY = 'webhooks:retry'
+    MAX_RETRIES = 5
+    RETRY_BACKOFF_SECONDS = 5
+
+    def __init__(self):
+        self.redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(
+            self.redis_url,
+            socket_connect_timeout=1,
+            socket_timeout=5
+        )
+
+    def enqueue(self, webhook_event_id: str) -> bool:
+        """Queue a committed webhook event; falls back to processing inline if Redis is down"""
+        try:
+            self.client.lpush(self.QUEUE_KEY, webhook_event_id)
+            return True
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Webhook queue unavailable, processing event inline: {str(e)}")
+            self.process(webhook_event_id)
+            return False
+
+    def process(self, webhook_event_id: str):
+        """Run the processor for a stored event, recording success or the failure for a retry"""
+        webhook_event = db.session.get(WebhookEvent, webhook_event_id)
+        if not webhook_event or webhook_event.processed:
+            return
+
+        # WhatsApp payloads carry their own finer-grained type (e.g. message_status)
+        event_type = webhook_event.payload.get('type', webhook_event.event_type)
+        processor = EVENT_PROCESSORS.get((webhook_event.source, event_type))
+
+        try:
+            result = processor(webhook_event.payload, webhook_event.id) if processor else None
+            conversation_id, send = result or (None, None)
+            webhook_event.mark_processed()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to process webhook event {webhook_event_id}: {str(e)}")
+
+            webhook_event = db.session.get(WebhookEvent, webhook_event_id)
+            webhook_event.mark_failed(str(e))
+            db.session.commit()
+
+            if webhook_event.can_retry(self.MAX_RETRIES):
+                self._schedule_retry(webhook_event_id, webhook_event.retry_count)
+            else:
+                logger.error(f"Giving up on webhook event {webhook_event_id} after {webhook_event.retry_count} attempts")
+            return
+
+        if conversation_id:
+            conversation_cache.invalidate(conversation_id)
+
+        # The event is committed as processed, so outbound calls happen at most once
+        if send:
+            try:
+                send()
+            except Exception as e:
+                logger.error(f"Outbound calls for webhook event {webhook_event_id} failed: {str(e)}")
+
+    def _schedule_retry(self, webhook_event_id: str, retry_count: int):
+        """Park a failed event until its backoff has passed; if Redis is down it is picked up when a worker starts"""
+        due_at = time.time() + self.RETRY_BACKOFF_SECONDS * 2 ** max(retry_count - 1, 0)
+        try:
+            self.client.zadd(self.RETRY_KEY, {webhook_event_id: due_at})
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Could not schedule retry for webhook event {webhook_event_id}: {str(e)}")
+
+    def _enqueue_due_retries(self, limit: int = 100):
+        """Move retries whose backoff has passed onto the queue"""
+        for webhook_event_id in self.client.zrangebyscore(self.RETRY_KEY, 0, time.time(), start=0, num=limit):
+            # Only the worker that removes the entry queues it
+            if self.client.zrem(self.RETRY_KEY, webhook_event_id):
+                self.client.lpush(self.QUEUE_KEY, webhook_event_id)
+
+    def schedule_failed_events(self):
+        """Schedule retries for failed events that are not waiting in Redis, e.g. after Redis was down"""
+        for webhook_event in WebhookEvent.get_failed_events(self.MAX_RETRIES):
+            self._schedule_retry(webhook_event.id, webhook_event.retry_count)
+
+    def drain(self, timeout: int = 1) -> int:
+        """Queue due retries, then pop one queued event and process it"""
+        self._enqueue_due_retries()
+        item = self.client.brpop(self.QUEUE_KEY, timeout=timeout)
+        if not item:
+            return 0
+
+        self.process(item[1].decode('utf-8'))
+        return 1
+
+    def run_worker(self, app, timeout: int = 1):
+        """Block forever, processing queued webhook events as they arrive"""
+        with app.app_context():
+            logger.info("Webhook worker started")
+            self.schedule_failed_events()
+            db.session.remove()
+            while True:
+                try:
+                    self.drain(timeout=timeout)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Failed to process webhook event: {str(e)}")
+                finally:
+                    db.session.remove()
+
+# Global instance
+webhook_queue = WebhookQueue()
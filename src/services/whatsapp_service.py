@@ -1,6 +1,10 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
+import re
+from functools import lru_cache
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 import logging
@@ -10,6 +14,9 @@ logger = logging.getLogger(__name__)
 class WhatsAppService:
     """Service for integrating with WhatsApp Business API"""
     
+    POOL_CONNECTIONS = 20
+    POOL_MAXSIZE = 50
+    
     def __init__(self):
         self.api_url = os.environ.get('WHATSAPP_API_URL', 'https://graph.facebook.com/v18.0')
         self.access_token = os.environ.get('WHATSAPP_ACCESS_TOKEN')
@@ -22,6 +29,19 @@ class WhatsAppService:
             'Authorization': f'Bearer {self.access_token}',
             'Content-Type': 'application/json'
         }
+        
+        # One pooled session per service keeps TCP/TLS connections alive between calls.
+        # Failed connects are retried; read errors and gateway errors only for idempotent
+        # methods, so no POST is sent twice
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=self.POOL_CONNECTIONS,
+            pool_maxsize=self.POOL_MAXSIZE,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), raise_on_status=False)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
     
     def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict:
         """Make HTTP request to WhatsApp API"""
@@ -29,13 +49,13 @@ class WhatsAppService:
         
         try:
             if method.upper() == 'GET':
-                response = requests.get(url, headers=self.headers, params=data)
+                response = self.session.get(url, params=data)
             elif method.upper() == 'POST':
-                response = requests.post(url, headers=self.headers, json=data)
+                response = self.session.post(url, json=data)
             elif method.upper() == 'PUT':
-                response = requests.put(url, headers=self.headers, json=data)
+                response = self.session.put(url, json=data)
             elif method.upper() == 'DELETE':
-                response = requests.delete(url, headers=self.headers)
+                response = self.session.delete(url)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
             
@@ -197,7 +217,7 @@ class WhatsAppService:
     def download_media(self, media_url: str) -> bytes:
         """Download media content"""
         try:
-            response = requests.get(media_url, headers=self.headers)
+            response = self.session.get(media_url)
             response.raise_for_status()
             return response.content
         except Exception as e:
@@ -389,23 +409,30 @@ class WhatsAppService:
     
     def format_phone_number(self, phone_number: str) -> str:
         """Format phone number for WhatsApp API"""
-        # Remove all non-digit characters
-        cleaned = ''.join(filter(str.isdigit, phone_number))
-        
-        # Add country code if missing (assuming Kazakhstan +7)
-        if len(cleaned) == 10 and cleaned.startswith('7'):
-            return cleaned
-        elif len(cleaned) == 10:
-            return f"7{cleaned}"
-        elif len(cleaned) == 11 and cleaned.startswith('8'):
-            return f"7{cleaned[1:]}"
-        
-        return cleaned
+        return _format_phone_number(phone_number)
     
     def validate_phone_number(self, phone_number: str) -> bool:
         """Validate phone number format"""
-        formatted = self.format_phone_number(phone_number)
-        return len(formatted) >= 10 and formatted.isdigit()
+        return _VALID_PHONE_RE.fullmatch(self.format_phone_number(phone_number)) is not None
+
+_NON_DIGIT_RE = re.compile(r'\D')
+_VALID_PHONE_RE = re.compile(r'\d{10,}')
+
+@lru_cache(maxsize=4096)
+def _format_phone_number(phone_number: str) -> str:
+    """Normalize a phone number to digits with a country code; memoized since customers write in repeatedly"""
+    # Remove all non-digit characters
+    cleaned = _NON_DIGIT_RE.sub('', phone_number)
+    
+    # Add country code if missing (assuming Kazakhstan +7)
+    if len(cleaned) == 10 and cleaned.startswith('7'):
+        return cleaned
+    elif len(cleaned) == 10:
+        return f"7{cleaned}"
+    elif len(cleaned) == 11 and cleaned.startswith('8'):
+        return f"7{cleaned[1:]}"
+    
+    return cleaned
 
 # Global instance
 whatsapp_service = WhatsAppService()
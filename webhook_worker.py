@@ -0,0 +1,8 @@
+import logging
+
+from app import app
+from src.services.webhook_queue import webhook_queue
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    webhook_queue.run_worker(app)